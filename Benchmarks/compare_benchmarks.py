@@ -0,0 +1,45 @@
+"""
+Compare two runs of run_benchmarks.py stored in the same JSON lines file (one run by commit)
+"""
+import json
+import os
+import pandas as pd
+
+# PARAMETERS
+input_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks.jsonl")  # Written by run_benchmarks.py
+baseline = None  # Commit of the reference run, the second to last commit of the file if None
+candidate = None  # Commit of the compared run, the last commit of the file if None
+regression_threshold = 1.1  # A benchmark 10% slower than the baseline is a regression
+
+
+def load_results(path):
+    with open(path) as file:
+        return pd.DataFrame([json.loads(line) for line in file if line.strip()])
+
+
+def compare(results, baseline, candidate, regression_threshold=1.1):
+    """
+    Time of each benchmark (best time, the last run of a commit if it was run several times)
+    for the two commits, with the ratio candidate / baseline of the times and of the peak memory
+    """
+    runs = results.groupby(["commit", "benchmark", "ticks"], dropna=False).last()
+    comparison = pd.DataFrame({"baseline_seconds": runs.loc[baseline, "seconds"],
+                               "candidate_seconds": runs.loc[candidate, "seconds"],
+                               "baseline_memory_mb": runs.loc[baseline, "peak_memory_mb"],
+                               "candidate_memory_mb": runs.loc[candidate, "peak_memory_mb"]}).dropna()
+    comparison["time_ratio"] = comparison["candidate_seconds"] / comparison["baseline_seconds"]
+    comparison["memory_ratio"] = comparison["candidate_memory_mb"] / comparison["baseline_memory_mb"]
+    comparison["regression"] = comparison["time_ratio"] > regression_threshold
+    return comparison
+
+
+if __name__ == '__main__':
+    results = load_results(input_path)
+    commits = list(dict.fromkeys(results["commit"]))
+    baseline = baseline or commits[-2]
+    candidate = candidate or commits[-1]
+
+    comparison = compare(results, baseline, candidate, regression_threshold)
+    print(f"Baseline {baseline} - Candidate {candidate}")
+    print(comparison.to_string(float_format=lambda value: f"{value:.4f}"))
+    print(f"{comparison['regression'].sum()} regression(s)")
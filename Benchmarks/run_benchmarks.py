@@ -0,0 +1,142 @@
+"""
+Benchmarks of the bar builders and of the cleaning on synthetic ticks. Each result is appended
+as one JSON line to the output file (with the commit), compare two runs with compare_benchmarks.py.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Generate alternatives candles"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Cleaning datasets"))
+from MakeTradingBars import MakeTradingBars
+from bar_features import FEATURES
+from functions_ticks_cleaning import basic_verifications, remove_outliers
+from synthetic_ticks import make_synthetic_ticks
+
+# PARAMETERS
+sizes = [10_000, 100_000, 1_000_000]  # Number of ticks of the benchmarks
+legacy_max_size = 10_000  # The legacy loops (vectorized=False) are only run on the small sizes
+repeats = 3  # The best time of the repeats is kept
+seed = 0  # Seed of the synthetic ticks
+output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks.jsonl")  # Next to the script (not versioned)
+k = 5  # Window size of the outliers --> 2*k + 1
+gamma = 0.000035  # Granularity of the outliers
+
+
+def git_commit():
+    """
+    Commit of the benchmarked code (None outside of a git repository)
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def measure(function, setup, repeats=3):
+    """
+    Best and mean duration of function(setup()) over the repeats, and peak memory allocated by
+    one more call (measured apart: tracemalloc slows down the code). setup() is not measured.
+    """
+    durations = []
+    for _ in range(repeats):
+        argument = setup()
+        start = time.perf_counter()
+        function(argument)
+        durations.append(time.perf_counter() - start)
+
+    argument = setup()
+    tracemalloc.start()
+    function(argument)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(durations), float(np.mean(durations)), peak
+
+
+def benchmark_cases(ticks):
+    """
+    Benchmarks on one set of ticks: name -> (function, setup). The bars objects are created
+    again for each call (setup), so the arrays memoised by a previous call are not reused.
+    """
+    bars_ticks = ticks.copy()
+    bars_ticks["index"] = np.arange(len(bars_ticks))
+    mean_volume = bars_ticks["volume"].mean()
+    mean_dollar = (bars_ticks["volume"] * (bars_ticks["bid"] + bars_ticks["ask"]) / 2).mean()
+
+    def new_bars():
+        return MakeTradingBars(bars_ticks)
+
+    def pyramid_bars():
+        bars = MakeTradingBars(bars_ticks)
+        bars.build_time_pyramid("1T")
+        return bars
+
+    # Grid of bars of the sweep benchmark, compared with one builder call by spec
+    sweep_specs = [("tick", N) for N in [50, 100, 500, 1000]] + [("time", "1T"), ("time", "5T")]
+
+    # Entry dates of the slippage benchmarks: 1000 random ticks
+    entry_dates = bars_ticks.index[np.random.default_rng(seed).integers(0, len(bars_ticks), 1000)]
+    verified = basic_verifications(ticks[["bid", "ask"]])[0]
+
+    cases = {
+        "time_bars_building": (lambda bars: bars.time_bars_building("5T"), new_bars),
+        "tick_bars_building": (lambda bars: bars.tick_bars_building(1000), new_bars),
+        "tick_run_bars_building": (lambda bars: bars.tick_run_bars_building(100), new_bars),
+        "volume_bars_building": (lambda bars: bars.volume_bars_building(1000 * mean_volume), new_bars),
+        "dollar_bars_building": (lambda bars: bars.dollar_bars_building(1000 * mean_dollar), new_bars),
+        "volume_imbalance_bars_building": (lambda bars: bars.volume_imbalance_bars_building(30 * mean_volume),
+                                           new_bars),
+        "dollar_imbalance_bars_building": (lambda bars: bars.dollar_imbalance_bars_building(30 * mean_dollar),
+                                           new_bars),
+        "bars_sweep 4 tick sizes + 2 timeframes": (lambda bars: bars.bars_sweep(sweep_specs), new_bars),
+        "builders 4 tick sizes + 2 timeframes": (lambda bars: [bars.tick_bars_building(N) for N in [50, 100, 500, 1000]]
+                                                 + [bars.time_bars_building(f) for f in ["1T", "5T"]], new_bars),
+        "time_bars_building 5T + 1H + 4H": (lambda bars: [bars.time_bars_building(f) for f in ["5T", "1H", "4H"]],
+                                            new_bars),
+        "time_bars_building 5T + 1H + 4H from 1T pyramid": (lambda bars: [bars.time_bars_building(f)
+                                                                          for f in ["5T", "1H", "4H"]], pyramid_bars),
+        "tick_bars_building with all the features": (lambda bars: bars.tick_bars_building(1000),
+                                                     lambda: MakeTradingBars(bars_ticks, features=list(FEATURES))),
+        "make_slippage_price x1000": (lambda bars: [bars.make_slippage_price(date, "bid", timedelta(seconds=1))
+                                                    for date in entry_dates], new_bars),
+        "make_slippage_prices x1000": (lambda bars: bars.make_slippage_prices(entry_dates, "bid",
+                                                                              timedelta(seconds=1)), new_bars),
+        "basic_verifications": (basic_verifications, lambda: ticks[["bid", "ask"]]),
+        "remove_outliers": (lambda df: remove_outliers(df, k, gamma), lambda: verified),
+    }
+
+    # The legacy loops are too slow for the large sizes
+    if len(ticks) <= legacy_max_size:
+        cases.update({
+            "time_bars_building legacy": (lambda bars: bars.time_bars_building("5T", vectorized=False), new_bars),
+            "tick_bars_building legacy": (lambda bars: bars.tick_bars_building(1000, vectorized=False), new_bars),
+            "tick_run_bars_building legacy": (lambda bars: bars.tick_run_bars_building(100, vectorized=False),
+                                              new_bars),
+            "remove_outliers legacy": (lambda df: remove_outliers(df, k, gamma, vectorized=False), lambda: verified),
+        })
+    return cases
+
+
+if __name__ == '__main__':
+    context = {"commit": git_commit(), "date": datetime.now().isoformat(timespec="seconds"),
+               "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+               "machine": platform.machine(), "seed": seed, "repeats": repeats}
+
+    with open(output_path, "a") as file:
+        for size in sizes:
+            ticks = make_synthetic_ticks(size, seed)
+            for name, (function, setup) in benchmark_cases(ticks).items():
+                best, mean, peak = measure(function, setup, repeats)
+                result = dict(context, benchmark=name, ticks=size, seconds=best, mean_seconds=mean,
+                              ticks_per_second=size / best, peak_memory_mb=peak / 2 ** 20)
+                file.write(json.dumps(result) + "\n")
+                file.flush()
+                print(f"{name} - {size} ticks: {best:.4f}s - {size / best:,.0f} ticks/s - "
+                      f"peak memory {peak / 2 ** 20:.1f} MB")
@@ -0,0 +1,76 @@
+"""
+Seeded generator of synthetic ticks which look like the MT5 ticks of a forex pair: the same
+seed always gives the same ticks, so the benchmarks of two commits run on the same data.
+"""
+import numpy as np
+import pandas as pd
+
+
+def make_synthetic_ticks(n, seed=0, start="2020-01-06", price=1.1, digits=5, duplicate_rate=0.01,
+                         outlier_rate=0.0005, error_rate=0.0002, volume=True):
+    """
+    Generate n ticks (DataFrame with the GMT time as index, bid, ask and volume columns).
+    - seed (int): seed of the random generator
+    - start (str): date of the first tick, the week-ends (friday 22h to sunday 22h GMT) have no tick
+    - price (float): first mid price
+    - digits (int): number of decimals of the prices
+    - duplicate_rate (float): share of ticks repeated with the same time and prices
+    - outlier_rate (float): share of ticks moved far from the price (outliers of the cleaning)
+    - error_rate (float): share of ticks with a null price or a bid higher than the ask
+    - volume (bool): add a volume column (MT5 does not give the volume of every symbol)
+
+    The arrivals are bursty (calm and agitated regimes, more ticks during the London and New York
+    sessions), the timestamps have a 1 second resolution like MT5 so many ticks share the same
+    time, and the spread widens when the activity is low.
+    """
+    rng = np.random.default_rng(seed)
+    point = 10 ** -digits
+
+    # 1. Arrivals: the regime switches between calm (1 tick / 4s) and agitated (3 ticks / s)
+    agitated = np.cumsum(rng.random(n) < 0.002) % 2 == 1
+    rate = np.where(agitated, 3.0, 0.25)
+    gaps = rng.exponential(1 / rate)
+
+    # Intraday seasonality: the arrivals are drawn in an activity clock which runs faster during
+    # the London and New York sessions (7h-17h GMT) and converted back to the clock of the week
+    activity = np.cumsum(gaps)
+    hours = (22 + np.arange(int(activity[-1] / 3600 / 0.5) + 2)) % 24  # From sunday 22h
+    speed = np.where((hours >= 7) & (hours < 17), 2.0, 0.5)
+    activity_knots = np.append(0, np.cumsum(speed * 3600))
+    seconds = np.interp(activity, activity_knots, np.arange(len(activity_knots)) * 3600.0)
+
+    # The week-ends are skipped: a trading week lasts 5 days from sunday 22h to friday 22h
+    week = 5 * 24 * 3600
+    seconds = (seconds // week) * 7 * 24 * 3600 + seconds % week
+    first = pd.Timestamp(start, tz="GMT").normalize() - pd.Timedelta(hours=2)  # Sunday 22h for a monday
+    time = first.value + (np.floor(seconds) * 10 ** 9).astype("int64")
+
+    # 2. Prices: random walk of the mid price with a larger volatility in the agitated regime
+    steps = rng.normal(0, np.where(agitated, 0.6, 0.3)) * point
+    mid = price + np.cumsum(steps)
+    spread_points = np.round(np.clip(rng.lognormal(np.log(np.where(agitated, 2, 6)), 0.4), 1, 50))
+    bid = np.round(mid - spread_points * point / 2, digits)
+    ask = np.round(bid + spread_points * point, digits)
+
+    # 3. Outliers: isolated ticks moved by 20 to 100 points
+    outliers = rng.random(n) < outlier_rate
+    shift = rng.choice([-1, 1], n) * rng.integers(20, 100, n) * point
+    bid = np.where(outliers, np.round(bid + shift, digits), bid)
+    ask = np.where(outliers, np.round(ask + shift, digits), ask)
+
+    # 4. Errors removed by basic_verifications: null prices and bid higher than ask
+    errors = rng.random(n) < error_rate
+    null_price = errors & (rng.random(n) < 0.5)
+    bid = np.where(null_price, 0, bid)
+    inverted = errors & ~null_price
+    bid, ask = np.where(inverted, ask, bid), np.where(inverted, bid, ask)
+
+    ticks = pd.DataFrame({"bid": bid, "ask": ask},
+                         index=pd.DatetimeIndex(time).tz_localize("UTC").tz_convert("GMT").rename("time"))
+    if volume:
+        ticks["volume"] = rng.geometric(0.3, n)
+
+    # 5. Duplicates: some ticks are received twice
+    duplicates = np.flatnonzero(rng.random(n) < duplicate_rate)
+    positions = np.sort(np.concatenate([np.arange(n), duplicates]))
+    return ticks.iloc[positions[:n]]
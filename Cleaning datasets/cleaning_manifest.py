@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from functions_ticks_cleaning import from_compact
+
+MANIFEST_NAME = "manifest.jsonl"
+
+
+def file_fingerprint(path, use_hash=False):
+    """
+    Size and modification time of a file, plus the sha256 of its content if use_hash
+    (slower but robust to a copy which changes the modification time)
+    """
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+    if use_hash:
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                sha256.update(block)
+        fingerprint["sha256"] = sha256.hexdigest()
+
+    return fingerprint
+
+
+def load_manifest(folder_end_path, parameters):
+    """
+    Load the manifest stored next to the cleaned files: a dictionary with one entry by
+    source file (path relative to the source folder).
+
+    The manifest is a journal with the cleaning parameters on the first line and one line
+    by cleaned file, so a crash only loses the files which were being cleaned. It is
+    compacted at each loading. If the parameters changed, all the files are cleaned again.
+    """
+    manifest_path = os.path.join(folder_end_path, MANIFEST_NAME)
+    manifest = {}
+
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            lines = [json.loads(line) for line in file if line.strip()]
+        if lines and lines[0].get("parameters") == parameters:
+            for line in lines[1:]:
+                if line.get("removed"):
+                    manifest.pop(line["path"], None)
+                else:
+                    manifest[line["path"]] = line
+
+    # Rewrite the compacted journal atomically
+    os.makedirs(folder_end_path, exist_ok=True)
+    with open(manifest_path + ".tmp", "w") as file:
+        file.write(json.dumps({"parameters": parameters}) + "\n")
+        for entry in manifest.values():
+            file.write(json.dumps(entry) + "\n")
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    return manifest
+
+
+def append_to_journal(folder_end_path, line):
+    """
+    Append one line to the journal of the manifest
+    """
+    with open(os.path.join(folder_end_path, MANIFEST_NAME), "a") as file:
+        file.write(json.dumps(line) + "\n")
+
+
+def record_file(folder_end_path, manifest, entry):
+    """
+    Add or replace the entry of a cleaned file (entry["path"]) in the manifest and its journal
+    """
+    manifest[entry["path"]] = entry
+    append_to_journal(folder_end_path, entry)
+
+
+def forget_removed_files(folder_end_path, manifest, keys):
+    """
+    Remove from the manifest the source files which are not in keys anymore
+    """
+    for key in [key for key in manifest if key not in keys]:
+        manifest.pop(key)
+        append_to_journal(folder_end_path, {"path": key, "removed": True})
+
+
+def changed_files(manifest, paths, folder_path, folder_end_path, use_hash=False):
+    """
+    Paths of the source files which are new, changed since their last cleaning or
+    whose cleaned file is missing. Return them with the fingerprint of every path.
+    """
+    changed = []
+    fingerprints = {}
+    for path in paths:
+        key = os.path.relpath(path, folder_path)
+        fingerprints[path] = file_fingerprint(path, use_hash)
+
+        entry = manifest.get(key)
+        if (entry is None or entry["fingerprint"] != fingerprints[path]
+                or not os.path.exists(path.replace(folder_path, folder_end_path))):
+            changed.append(path)
+
+    return changed, fingerprints
+
+
+def edges_to_entry(head, tail):
+    """
+    Store the first and last verified ticks of a file (bid and ask) in its manifest entry
+    """
+    # The compact ticks are stored with their float prices
+    return {"head": from_compact(head)[["bid", "ask"]].to_numpy(dtype="float64").tolist(),
+            "tail": from_compact(tail)[["bid", "ask"]].to_numpy(dtype="float64").tolist()}
+
+
+def edges_from_entry(entry):
+    """
+    First and last verified ticks of a file stored in its manifest entry
+    """
+    return (pd.DataFrame(entry["head"], columns=["bid", "ask"], dtype="float64"),
+            pd.DataFrame(entry["tail"], columns=["bid", "ask"], dtype="float64"))
+
+
+def halo_fingerprint(before, after):
+    """
+    Hash of the ticks given as halo to a file, to know if a file must be cleaned again
+    because the ticks of its neighbours changed
+    """
+    sha1 = hashlib.sha1()
+    for ticks in [before, after]:
+        values = np.empty((0, 2)) if ticks is None else ticks[["bid", "ask"]].to_numpy(dtype="float64")
+        sha1.update(str(values.shape).encode())
+        sha1.update(np.ascontiguousarray(values).tobytes())
+    return sha1.hexdigest()
+
+
+def manifest_stats(manifest):
+    """
+    Percentage of negative prices, bid above ask and outliers of each file of the
+    manifest (the files without ticks are skipped)
+    """
+    entries = [entry for entry in manifest.values() if entry["nb_ticks"] > 0]
+    pct_errors_negprice = [entry["nb_errors_negprice"] / entry["nb_ticks"] * 100 for entry in entries]
+    pct_errors_bidsup = [entry["nb_errors_bidsup"] / entry["nb_ticks"] * 100 for entry in entries]
+    pct_outliers = [entry["nb_outliers"] / entry["nb_ticks"] * 100 for entry in entries]
+    return pct_errors_negprice, pct_errors_bidsup, pct_outliers
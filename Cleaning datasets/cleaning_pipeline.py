@@ -0,0 +1,198 @@
+"""
+Staged pipeline for the cleaning of many files: the files are read (and decompressed) by
+threads, cleaned by processes and written by threads. The stages are connected by bounded
+queues, so the disk works while the CPU cleans, and a slow stage blocks the previous one
+instead of accumulating the ticks in memory (at most queue_size files wait between two stages).
+"""
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count
+from tqdm import tqdm
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "How to import large dataset"))
+from instrumentation import stage
+
+STAGES = ["read", "clean", "write"]
+
+
+def timed_call(function, data, metrics=None, path=None):
+    """
+    Call a function in a worker process and return its result with its duration
+    """
+    start = time.perf_counter()
+    with stage(metrics, "clean", path=path):
+        result = function(data)
+    return result, time.perf_counter() - start
+
+
+def run_pipeline(tasks, read, clean, write, readers=2, cleaners=None, writers=1, queue_size=4, on_result=None,
+                 description="Cleaning", metrics=None):
+    """
+    Run read -> clean -> write on each task.
+    - tasks (list): tuples whose first element is the path of the file (with the other arguments
+      of the task, the halos for example)
+    - read(task): runs in a thread, return the data given to clean
+    - clean(data): runs in a process (top-level function), return the data given to write
+    - write(task, cleaned): runs in a thread, return the result of the task
+    - readers, cleaners, writers (int): number of workers of each stage (cleaners = cpu_count() if None)
+    - queue_size (int): number of files which can wait between two stages
+    - on_result(task, result): called after each write, one call at a time (to save it in the manifest),
+      the file is a failure if it raises
+    - metrics (Metrics): optional, every read, clean and write is also measured as a stage
+      (see instrumentation.py), with the error if it failed
+
+    Return the results by path, the errors by path (the failed tasks are skipped by the next
+    stages) and the statistics of the stages (see print_stats).
+    """
+    cleaners = cleaners or cpu_count()
+    results, failures = {}, {}
+    stats = {stage_name: {"workers": workers, "files": 0, "busy": 0.0, "waiting": 0.0, "blocked": 0.0}
+             for stage_name, workers in zip(STAGES, [readers, cleaners, writers])}
+    lock = threading.Lock()
+
+    todo = queue.Queue()
+    for task in tasks:
+        todo.put(task)
+    read_queue = queue.Queue(queue_size)  # (task, data) read and waiting to be cleaned
+    running = queue.Queue()  # (task, future) in the order of submission to the processes
+    write_queue = queue.Queue(queue_size)  # (task, cleaned) waiting to be written
+    slots = threading.Semaphore(cleaners + queue_size)  # Files in the processes (sent or cleaned)
+    progress = tqdm(total=len(tasks), desc=description)
+
+    def add_stats(stage_name, busy=0.0, waiting=0.0, blocked=0.0, files=0):
+        with lock:
+            stats[stage_name]["busy"] += busy
+            stats[stage_name]["waiting"] += waiting
+            stats[stage_name]["blocked"] += blocked
+            stats[stage_name]["files"] += files
+
+    def fail(task, error):
+        with lock:
+            failures[task[0]] = repr(error)
+            progress.update()
+
+    def put(stage_name, output_queue, item):
+        # The time spent waiting for a free place is the back-pressure of the next stage
+        start = time.perf_counter()
+        output_queue.put(item)
+        add_stats(stage_name, blocked=time.perf_counter() - start)
+
+    def get(stage_name, input_queue):
+        start = time.perf_counter()
+        item = input_queue.get()
+        add_stats(stage_name, waiting=time.perf_counter() - start)
+        return item
+
+    def reader():
+        while True:
+            try:
+                task = todo.get_nowait()
+            except queue.Empty:
+                return
+            start = time.perf_counter()
+            try:
+                with stage(metrics, "read", path=task[0]):
+                    data = read(task)
+            except Exception as error:
+                fail(task, error)
+                continue
+            add_stats("read", busy=time.perf_counter() - start, files=1)
+            put("read", read_queue, (task, data))
+
+    def submitter(executor):
+        # Send the files read to the processes, the semaphore bounds the files in the processes
+        try:
+            while True:
+                item = get("clean", read_queue)
+                if item is None:
+                    return
+                slots.acquire()
+                try:
+                    future = executor.submit(timed_call, clean, item[1], metrics, item[0][0])
+                except Exception as error:
+                    # A dead process breaks the pool: the next files fail but the readers are still drained
+                    slots.release()
+                    fail(item[0], error)
+                    continue
+                running.put((item[0], future))
+        finally:
+            # The collector and the writers always stop
+            running.put(None)
+
+    def collector():
+        while True:
+            item = running.get()
+            if item is None:
+                for _ in range(writers):
+                    write_queue.put(None)
+                return
+            task, future = item
+            try:
+                cleaned, busy = future.result()
+            except Exception as error:
+                slots.release()
+                fail(task, error)
+                continue
+            add_stats("clean", busy=busy, files=1)
+            put("clean", write_queue, (task, cleaned))
+            slots.release()
+
+    def writer():
+        while True:
+            item = get("write", write_queue)
+            if item is None:
+                return
+            task, cleaned = item
+            start = time.perf_counter()
+            try:
+                with stage(metrics, "write", path=task[0]):
+                    result = write(task, cleaned)
+                # A file whose result is not saved (manifest) is a failed file, the writer goes on
+                if on_result is not None:
+                    with lock:
+                        on_result(task, result)
+            except Exception as error:
+                fail(task, error)
+                continue
+            add_stats("write", busy=time.perf_counter() - start, files=1)
+            with lock:
+                results[task[0]] = result
+                progress.update()
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(cleaners) as executor:
+        threads = [threading.Thread(target=submitter, args=(executor,)), threading.Thread(target=collector)]
+        threads += [threading.Thread(target=writer) for _ in range(writers)]
+        reader_threads = [threading.Thread(target=reader) for _ in range(readers)]
+        for thread in threads + reader_threads:
+            thread.start()
+
+        # All the files are read: the end is propagated through the stages
+        for thread in reader_threads:
+            thread.join()
+        read_queue.put(None)
+        for thread in threads:
+            thread.join()
+    progress.close()
+
+    for stage_name in STAGES:
+        stats[stage_name]["wall"] = time.perf_counter() - start
+    return results, failures, stats
+
+
+def print_stats(stats):
+    """
+    Throughput of each stage: files per second of work of one worker and share of the time
+    its workers were busy (the stage with the busiest workers needs more workers), with the
+    seconds spent waiting for the previous stage and blocked by the next one (full queue)
+    """
+    for stage_name in STAGES:
+        stage_stats = stats[stage_name]
+        capacity = stage_stats["wall"] * stage_stats["workers"]
+        speed = stage_stats["files"] / stage_stats["busy"] if stage_stats["busy"] > 0 else float("nan")
+        print(f"{stage_name}: {stage_stats['workers']} worker(s) - {stage_stats['files']} file(s) - "
+              f"{speed:.2f} file(s)/s by worker - busy {100 * stage_stats['busy'] / capacity:.1f}% - "
+              f"waiting {stage_stats['waiting']:.1f}s - blocked {stage_stats['blocked']:.1f}s")
@@ -1,54 +1,101 @@
 import numpy as np
 import pandas as pd
 from functions_ticks_cleaning import *
+from cleaning_manifest import load_manifest, record_file, forget_removed_files, changed_files, manifest_stats
+from cleaning_pipeline import run_pipeline, print_stats
+from instrumentation import Metrics, summarize
 from datetime import datetime
+import os
 
 # PARAMETERS
 k = 5  # Window size --> 2*k + 1
 gamma = 0.000035  # Granularity (security threshold to avoid finding outliers which are not)
 folder_path = "../../../EURUSD-Z-Admiral-Markets"
 folder_end_path = "../../../EURUSD-Z-Admiral-Markets-clean"
+use_hash = False  # Detect the changed files with a hash of their content instead of their size and date
+compact = False  # Clean the prices as int32 numbers of points (less memory), the saved files are the same
+digits = 5  # Number of digits of the prices for the compact representation
 
-pct_errors_negprice = []
-pct_errors_bidsup = []
-pct_outliers = []
+readers = 2  # Threads which read and decompress the files
+cleaners = os.cpu_count()  # Processes which clean the ticks
+writers = 1  # Threads which compress and write the cleaned files
+queue_size = 4  # Number of files which can wait between two stages (bounds the memory)
+metrics_path = None  # JSON lines file where the duration of every stage is written (see instrumentation.py), None to disable
 
-# RUN
-paths = traverse_save_paths(folder_path)
-start = datetime.now()
+metrics = Metrics(metrics_path) if metrics_path else None
+
+
+def read_ticks(task):
+    return pd.read_parquet(task[0])
 
-for path in paths:
-    print(path)
 
-    # Initialize the run
-    df = pd.read_parquet(path)
+def clean_ticks(df):
+    """
+    Clean the ticks of one file (in a process of the pipeline)
+    """
+    if compact:
+        df = to_compact(df, digits)
     size = len(df)
 
     # Clean the dataset
-    df_verified, nb_errors_negprice, nb_errors_bidsup = basic_verifications(df)
-    df_clean, nb_outliers = remove_outliers(df_verified, k, gamma)
+    df_verified, nb_errors_negprice, nb_errors_bidsup = basic_verifications(df, metrics)
+    df_clean, nb_outliers = remove_outliers(df_verified, k, gamma, metrics=metrics)
 
-    # Store the data with a try excpet because sometimes size=0
-    try:
-        pct_errors_negprice.append(nb_errors_negprice/size*100)
-        pct_errors_bidsup.append(nb_errors_bidsup/size*100)
-        pct_outliers.append(nb_outliers/size*100)
+    entry = {"nb_ticks": size, "nb_errors_negprice": nb_errors_negprice,
+             "nb_errors_bidsup": nb_errors_bidsup, "nb_outliers": nb_outliers}
+    return from_compact(df_clean), entry
 
-    except:
-        pass
 
+def save_ticks(task, cleaned):
     # Save cleaned data
-    save_path = path.replace(folder_path, folder_end_path)
+    df_clean, entry = cleaned
+    save_path = task[0].replace(folder_path, folder_end_path)
     save_path_folder = save_path[:save_path.rfind('/')]
     maybe_make_dir(save_path_folder)
     df_clean.to_parquet(save_path, compression='gzip')
+    return entry
+
+
+# RUN
+if __name__ == '__main__':
+    paths = traverse_save_paths(folder_path)
+    start = datetime.now()
+
+    # The manifest tells us which files are already cleaned with these parameters
+    manifest = load_manifest(folder_end_path, {"k": k, "gamma": gamma, "halo": False})
+    forget_removed_files(folder_end_path, manifest, {os.path.relpath(path, folder_path) for path in paths})
+    changed, fingerprints = changed_files(manifest, paths, folder_path, folder_end_path, use_hash)
+
+    def save_entry(task, entry):
+        # Store the errors in the manifest, the file will not be cleaned again if it does not change
+        entry.update({"path": os.path.relpath(task[0], folder_path), "fingerprint": fingerprints[task[0]]})
+        record_file(folder_end_path, manifest, entry)
+
+    # The files are read, cleaned and written at the same time by the stages of the pipeline
+    results, failures, stats = run_pipeline([(path,) for path in changed], read_ticks, clean_ticks, save_ticks,
+                                            readers, cleaners, writers, queue_size, on_result=save_entry,
+                                            metrics=metrics)
+
+    # The statistics are computed on all the files of the manifest
+    pct_errors_negprice, pct_errors_bidsup, pct_outliers = manifest_stats(manifest)
+
+    print(f"{len(results)} file(s) cleaned, {len(paths) - len(changed)} file(s) already clean")
+    print(f"Negative or null prices - Average {np.mean(pct_errors_negprice)}% \t Max {np.max(pct_errors_negprice)}%")
+    print(f"Bid prices higher than Ask prices - Average {np.mean(pct_errors_bidsup)}% \t Max {np.max(pct_errors_bidsup)}%")
+    print(f"Outliers: - Average {np.mean(pct_outliers)}% \t Max {np.max(pct_outliers)}%")
+
+    # Throughput of the stages, to choose the number of readers, cleaners and writers
+    print_stats(stats)
+    if metrics_path:
+        print(summarize(metrics_path).to_string())
 
-print(f"Negative or null prices - Average {np.mean(pct_errors_negprice)}% \t Max {np.max(pct_errors_negprice)}%")
-print(f"Bid prices higher than Ask prices - Average {np.mean(pct_errors_bidsup)}% \t Max {np.max(pct_errors_bidsup)}%")
-print(f"Outliers: - Average {np.mean(pct_outliers)}% \t Max {np.max(pct_outliers)}%")
+    # Report the files which could not be cleaned
+    print(f"{len(failures)} file(s) failed")
+    for path, error in failures.items():
+        print(f"{path}: {error}")
 
-end = datetime.now()
-diff = (end-start).total_seconds()
+    end = datetime.now()
+    diff = (end-start).total_seconds()
 
-# return the number of seconds taken
-print(diff)
\ No newline at end of file
+    # return the number of seconds taken
+    print(diff)
\ No newline at end of file
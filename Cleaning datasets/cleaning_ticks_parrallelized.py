@@ -2,7 +2,12 @@ import numpy as np
 import pandas as pd
 from multiprocessing import Pool, cpu_count
 from datetime import datetime
-from functions_ticks_cleaning import basic_verifications, remove_outliers, traverse_save_paths
+from functions_ticks_cleaning import basic_verifications, remove_outliers, traverse_save_paths, to_compact, \
+    from_compact
+from cleaning_manifest import (load_manifest, record_file, forget_removed_files, changed_files, edges_to_entry,
+                               edges_from_entry, halo_fingerprint, manifest_stats)
+from cleaning_pipeline import run_pipeline, print_stats
+from instrumentation import Metrics, summarize, stage
 from tqdm import tqdm
 import os
 # PARAMETERS
@@ -10,57 +15,184 @@ k = 5 # Window size --> 2*k + 1
 gamma = 0.000005  # Granularity (security threshold to avoid finding outliers which are not)
 folder_path = "../../../EURUSD-Z-Admiral-Markets"
 folder_end_path = "../../../EURUSD-Z-Admiral-Markets-clean-test"
+use_hash = False  # Detect the changed files with a hash of their content instead of their size and date
+compact = False  # Clean the prices as int32 numbers of points (less memory), the saved files are the same
+digits = 5  # Number of digits of the prices for the compact representation
+readers = 2  # Threads which read and decompress the files to clean
+writers = 1  # Threads which compress and write the cleaned files
+queue_size = 4  # Number of files which can wait between two stages of the cleaning (bounds the memory)
+metrics_path = None  # JSON lines file where the duration of every stage is written (see instrumentation.py), None to disable
+
+metrics = Metrics(metrics_path) if metrics_path else None
 
 def maybe_make_dir(directory_path):
     """
     Create the folder path to store our data if it doesn't exist
     """
     if not os.path.exists(directory_path):
-        os.makedirs(directory_path)
+        # Several workers can create the same folder at the same time
+        os.makedirs(directory_path, exist_ok=True)
         print(f"The Folder '{directory_path}' has been created.")
 
-def process_file(path):
-    df = pd.read_parquet(path)
+def verified_ticks(path, df=None):
+    """
+    Load a file (if df is not already read) and apply the verifications which only depend on
+    the ticks of this file
+    """
+    if df is None:
+        df = pd.read_parquet(path)
+    if compact:
+        df = to_compact(df, digits)
     df = df.drop_duplicates()
     size = len(df)
 
-    df_verified, nb_errors_negprice, nb_errors_bidsup = basic_verifications(df)
-    df_clean, nb_outliers = remove_outliers(df_verified, k, gamma)
+    df_verified, nb_errors_negprice, nb_errors_bidsup = basic_verifications(df, metrics)
+    return df_verified, size, nb_errors_negprice, nb_errors_bidsup
+
+def file_edges(path):
+    """
+    First and last k verified ticks of a file, they are the halo of the neighbouring files
+    """
+    # The halos are given with their float prices (like the edges stored in the manifest)
+    with stage(metrics, "edges", path=path):
+        df_verified = from_compact(verified_ticks(path)[0][["bid", "ask"]])
+    return df_verified.iloc[:k], df_verified.iloc[max(len(df_verified) - k, 0):]
+
+def make_halos(edges):
+    """
+    For each file, the k ticks just before and just after it. They are taken from several
+    files when the neighbouring one has less than k ticks, the files which failed are skipped.
+    """
+    halos_before, halos_after = [], []
+    for i in range(len(edges)):
+
+        # Only the closest files are needed to get k ticks
+        before_ticks, j = [], i - 1
+        while j >= 0 and sum(len(ticks) for ticks in before_ticks) < k:
+            if edges[j] is not None:
+                before_ticks.insert(0, edges[j][1])
+            j -= 1
+
+        after_ticks, j = [], i + 1
+        while j < len(edges) and sum(len(ticks) for ticks in after_ticks) < k:
+            if edges[j] is not None:
+                after_ticks.append(edges[j][0])
+            j += 1
+
+        halos_before.append(pd.concat(before_ticks).iloc[-k:] if before_ticks else None)
+        halos_after.append(pd.concat(after_ticks).iloc[:k] if after_ticks else None)
+    return halos_before, halos_after
+
+def read_file(task):
+    """
+    Ticks of a file to clean with its halos (reader threads of the pipeline)
+    """
+    path, before, after = task
+    return path, pd.read_parquet(path), before, after
+
+def clean_file(data):
+    """
+    Clean the ticks of one file (processes of the pipeline)
+    """
+    path, df, before, after = data
+    df_verified, size, nb_errors_negprice, nb_errors_bidsup = verified_ticks(path, df)
+
+    # The halo completes the rolling windows at the edges of the file (midnight)
+    df_clean, nb_outliers = remove_outliers(df_verified, k, gamma, before=before, after=after, metrics=metrics)
 
-    save_path = path.replace(folder_path, folder_end_path)
+    # Entry of the file in the manifest (with its edges, they are the halo of its neighbours)
+    entry = {"nb_ticks": size, "nb_errors_negprice": nb_errors_negprice, "nb_errors_bidsup": nb_errors_bidsup,
+             "nb_outliers": nb_outliers, "halo": halo_fingerprint(before, after)}
+    entry.update(edges_to_entry(df_verified.iloc[:k], df_verified.iloc[max(len(df_verified) - k, 0):]))
+    return from_compact(df_clean), entry
+
+def write_file(task, cleaned):
+    """
+    Save the cleaned ticks of a file (writer threads of the pipeline)
+    """
+    df_clean, entry = cleaned
+    save_path = task[0].replace(folder_path, folder_end_path)
     save_path_folder = save_path[:save_path.rfind('/')]
     maybe_make_dir(save_path_folder)
     df_clean.to_parquet(save_path, compression='gzip')
-    return nb_errors_negprice / size * 100, nb_errors_bidsup / size * 100, nb_outliers / size * 100
+    return entry
 
+def run_tasks(pool, function, tasks, failures, description, on_result=None):
+    """
+    Run the tasks in the pool and return their results in the same order,
+    None for the tasks which failed (the error is stored in failures by path).
+    on_result(task, result) is called as soon as each result is available.
+    """
+    async_results = [pool.apply_async(function, task) for task in tasks]
+
+    results = []
+    for task, result in tqdm(zip(tasks, async_results), total=len(tasks), desc=description):
+        try:
+            results.append(result.get())
+        except Exception as error:
+            failures[task[0]] = repr(error)
+            results.append(None)
+            continue
+        if on_result is not None:
+            on_result(task, results[-1])
+    return results
 
 if __name__ == '__main__':
     paths = traverse_save_paths(folder_path)
     start = datetime.now()
 
-    # Initialize the list to save the data
-    pct_errors_negprice = []
-    pct_errors_bidsup = []
-    pct_outliers = []
+    # The manifest tells us which files are already cleaned with these parameters
+    manifest = load_manifest(folder_end_path, {"k": k, "gamma": gamma, "halo": True})
+    keys = {path: os.path.relpath(path, folder_path) for path in paths}
+    forget_removed_files(folder_end_path, manifest, set(keys.values()))
+    changed, fingerprints = changed_files(manifest, paths, folder_path, folder_end_path, use_hash)
+
+    def save_entry(task, entry):
+        entry.update({"path": keys[task[0]], "fingerprint": fingerprints[task[0]]})
+        record_file(folder_end_path, manifest, entry)
+
+    # Errors by file path
+    failures = {}
 
     # Prepare the multi-processing
-    with Pool(processes=int(cpu_count()/2)) as pool:
-        results = [pool.apply_async(process_file, (path,)) for path in paths]
+    with Pool(processes=cpu_count()) as pool:
+        # 1. We extract the edges of each changed file to give every worker the ticks around its file,
+        # the edges of the other files are stored in the manifest
+        changed_edges = run_tasks(pool, file_edges, [(path,) for path in changed], failures, "Edges")
+        changed_edges = dict(zip(changed, changed_edges))
+        edges = [changed_edges[path] if path in changed_edges else edges_from_entry(manifest[keys[path]])
+                 for path in paths]
+        halos_before, halos_after = make_halos(edges)
 
-        for result in tqdm(results):
-            try:
-                nb_errors_negprice, nb_errors_bidsup, nb_outliers = result.get()
-                pct_errors_negprice.append(nb_errors_negprice)
-                pct_errors_bidsup.append(nb_errors_bidsup)
-                pct_outliers.append(nb_outliers)
+    # 2. We clean the changed files and the files whose halo changed,
+    # the result is the same as cleaning all the ticks at once
+    tasks = [(path, before, after) for path, before, after in zip(paths, halos_before, halos_after)
+             if path not in failures and (path in changed_edges
+                                          or manifest[keys[path]]["halo"] != halo_fingerprint(before, after))]
 
-            except:
-                pass
+    # The files are read, cleaned and written at the same time by the stages of the pipeline
+    cleaning_failures, stats = run_pipeline(tasks, read_file, clean_file, write_file, readers, cpu_count(), writers,
+                                            queue_size, on_result=save_entry, metrics=metrics)[1:]
+    failures.update(cleaning_failures)
 
+    # The statistics are computed on all the files of the manifest
+    pct_errors_negprice, pct_errors_bidsup, pct_outliers = manifest_stats(manifest)
+
+    print(f"{len(tasks)} file(s) cleaned, {len(paths) - len(tasks)} file(s) already clean")
     print(f"Negative or null prices: {np.mean(pct_errors_negprice)}%")
     print(f"Bid prices higher than Ask prices: {np.mean(pct_errors_bidsup)}%")
     print(f"Outliers: {np.mean(pct_outliers)}%")
 
+    # Throughput of the stages of the cleaning, to choose the number of readers and writers
+    print_stats(stats)
+    if metrics_path:
+        print(summarize(metrics_path).to_string())
+
+    # Report the files which could not be cleaned
+    print(f"{len(failures)} file(s) failed")
+    for path, error in failures.items():
+        print(f"{path}: {error}")
+
     end = datetime.now()
     diff = (end - start).total_seconds()
     print(diff)
@@ -1,26 +1,33 @@
 import os
+import sys
 import numpy as np
 import pandas
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "How to import large dataset"))
+from compact_ticks import decode_prices, from_compact, to_compact
+from tick_store import list_partitions
+from instrumentation import stage
 
-def basic_verifications(df):
-    # 1. Sort index by chronological order
-    df = df.sort_index(ascending=True)
+def basic_verifications(df, metrics=None):
+    with stage(metrics, "basic_verifications", ticks=len(df)) as event:
+        # 1. Sort index by chronological order
+        df = df.sort_index(ascending=True)
 
-    # 2. We reset thte index because the dates are not unique (essential to drop only the wrong ticks not some others on the same date)
-    df = df.reset_index(drop=False)
+        # 2. We reset thte index because the dates are not unique (essential to drop only the wrong ticks not some others on the same date)
+        df = df.reset_index(drop=False)
 
-    # 3. We remove the rows when we have unsual cotation like price below 0 or egual 0
-    index_errors_negprice = list(df.loc[(df["bid"] <= 0) | (df["ask"] <= 0)].index)
-    df = df.drop(index_errors_negprice, axis=0, inplace=False)
-    nb_errors_negprice = len(index_errors_negprice)
+        # 3. We remove the rows when we have unsual cotation like price below 0 or egual 0
+        index_errors_negprice = list(df.loc[(df["bid"] <= 0) | (df["ask"] <= 0)].index)
+        df = df.drop(index_errors_negprice, axis=0, inplace=False)
+        nb_errors_negprice = len(index_errors_negprice)
 
-    # 4. We remove the rows when we have bid price above ask price
-    index_errors_bidsup = list(df.loc[df["ask"] < df["bid"]].index)
-    df = df.drop(index_errors_bidsup, axis=0, inplace=False)
-    nb_errors_bidsup = len(index_errors_bidsup)
+        # 4. We remove the rows when we have bid price above ask price
+        index_errors_bidsup = list(df.loc[df["ask"] < df["bid"]].index)
+        df = df.drop(index_errors_bidsup, axis=0, inplace=False)
+        nb_errors_bidsup = len(index_errors_bidsup)
 
-    # 5. Replace the date as index
-    df = df.set_index("time")
+        # 5. Replace the date as index
+        df = df.set_index("time")
+        event.update({"errors_negprice": nb_errors_negprice, "errors_bidsup": nb_errors_bidsup})
 
     return df, nb_errors_negprice, nb_errors_bidsup
 
@@ -34,41 +41,95 @@ def is_outlier(s, k, gamma):
     return abs(center_value - trimmed_mean) > 3 * std_dev + gamma
 
 
-def remove_outliers(df, k, gamma):
-    # 0. MANDATORY to remove only the wrong cotations
-    df = df.reset_index(drop=False)
+def outliers_mask(prices, k, gamma, chunk_size=262144):
+    """
+    Vectorized version of the rolling is_outlier test: for every tick, compare the
+    price to the mean and standard deviation of the 2*k ticks around it (the tick
+    itself excluded). The first and last k ticks are never tested, like with the
+    centered rolling window.
+
+    The trimmed windows are built with a sliding view of the prices and reduced in
+    the same order as pandas' mean and std so the flags are identical to is_outlier.
+    The windows are processed by chunks of chunk_size ticks to bound the memory.
+    """
+    prices = np.asarray(prices, dtype="float64")
+    mask = np.zeros(len(prices), dtype=bool)
+    if len(prices) < 2 * k + 1:
+        return mask
+
+    windows = np.lib.stride_tricks.sliding_window_view(prices, 2 * k + 1)
+    for start in range(0, len(windows), chunk_size):
+        chunk = windows[start:start + chunk_size]
 
-    # 1. We extract the index of the bid outliers
-    outliers_mask_bid = df['bid'].rolling(window=2 * k + 1, center=True).apply(
-        lambda s: is_outlier(s, k, gamma), raw=False)
-    outliers_index_bid = outliers_mask_bid[outliers_mask_bid == 1].index
+        # We remove the current value
+        trimmed = np.concatenate([chunk[:, :k], chunk[:, k + 1:]], axis=1)
+        trimmed_mean = trimmed.sum(axis=1) / (2 * k)
+        std_dev = np.sqrt(((trimmed_mean[:, None] - trimmed) ** 2).sum(axis=1) / (2 * k - 1))
 
-    # 2. We extract the index of the ask outliers
-    outliers_mask_ask = df['ask'].rolling(window=2 * k + 1, center=True).apply(
-        lambda s: is_outlier(s, k, gamma), raw=False)
-    outliers_index_ask = outliers_mask_ask[outliers_mask_ask == 1].index
+        mask[start + k:start + k + len(chunk)] = np.abs(chunk[:, k] - trimmed_mean) > 3 * std_dev + gamma
 
-    # 3. Drop the outliers
-    outliers_index = list(outliers_index_bid)
-    outliers_index.extend(list(outliers_index_ask))
-    outliers_index = list(set(outliers_index))  # we keep only the unique index
+    return mask
 
-    df_clean = df.drop(outliers_index, axis=0, inplace=False)
-    nb_outliers = len(outliers_index)
 
-    df_clean = df_clean.set_index("time")
+def remove_outliers(df, k, gamma, vectorized=True, before=None, after=None, metrics=None):
+    """
+    Remove the ticks whose bid or ask fails the outlier test.
+    - before, after (DataFrame): the ticks just before and just after df (for example
+      the last and first k ticks of the neighbouring files). They complete the windows
+      at the edges of df so the result is the same as cleaning all the ticks at once.
+
+    The ticks can be in the compact representation (see compact_ticks.py), the outlier test
+    is done on the decoded float prices so the result is the same.
+    - metrics (Metrics): optional, measure the outlier test (see instrumentation.py)
+    """
+    if (before is not None or after is not None) and not vectorized:
+        raise Exception("BEFORE and AFTER are only available with vectorized=True")
+
+    with stage(metrics, "outlier_test", ticks=len(df)) as event:
+        # 0. MANDATORY to remove only the wrong cotations
+        df = df.reset_index(drop=False)
+        digits = df.attrs.get("digits")
+
+        if vectorized:
+            # 1. We flag the bid and the ask outliers in one vectorized pass for each
+            nb_before = 0 if before is None else len(before)
+            outliers = np.zeros(len(df), dtype=bool)
+            for price_type in ['bid', 'ask']:
+                prices = [decode_prices(ticks[price_type].to_numpy(), digits) for ticks in [before, df, after]
+                          if ticks is not None]
+                outliers |= outliers_mask(np.concatenate(prices), k, gamma)[nb_before:nb_before + len(df)]
+            outliers_index = list(df.index[outliers])
+
+        else:
+            # 1. We extract the index of the bid outliers
+            prices = from_compact(df)
+            outliers_mask_bid = prices['bid'].rolling(window=2 * k + 1, center=True).apply(
+                lambda s: is_outlier(s, k, gamma), raw=False)
+            outliers_index_bid = outliers_mask_bid[outliers_mask_bid == 1].index
+
+            # 2. We extract the index of the ask outliers
+            outliers_mask_ask = prices['ask'].rolling(window=2 * k + 1, center=True).apply(
+                lambda s: is_outlier(s, k, gamma), raw=False)
+            outliers_index_ask = outliers_mask_ask[outliers_mask_ask == 1].index
+
+            # 3. Drop the outliers
+            outliers_index = list(outliers_index_bid)
+            outliers_index.extend(list(outliers_index_ask))
+            outliers_index = list(set(outliers_index))  # we keep only the unique index
+
+        df_clean = df.drop(outliers_index, axis=0, inplace=False)
+        nb_outliers = len(outliers_index)
+
+        df_clean = df_clean.set_index("time")
+        event["outliers"] = nb_outliers
 
     return df_clean, nb_outliers
 
 
 def traverse_save_paths(folder):
-    paths = []
-    for root, dirs, files in os.walk(folder):
-        for file_name in files:
-            if file_name.endswith('.parquet'):
-                full_path = os.path.join(root, file_name)
-                paths.append(full_path)
-    return paths
+    # The partitions of the tick store in chronological order ({year}/{month}/{day}.parquet,
+    # or {year}/{month}.parquet for the compacted months)
+    return list_partitions(folder)
 
 
 def maybe_make_dir(directory_path):
@@ -76,6 +137,6 @@ def maybe_make_dir(directory_path):
     Create the folder path to store our data if it doesn't exist
     """
     if not os.path.exists(directory_path):
-        os.makedirs(directory_path)
+        os.makedirs(directory_path, exist_ok=True)
         print(f"The Folder '{directory_path}' has been created.")
 
@@ -1,11 +1,377 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime, timedelta
+from functools import reduce, wraps
+from math import gcd
+from multiprocessing import cpu_count
+import os
+import sys
 import numpy as np
 import pandas as pd
 
+# The tick store (tick_store.py) is imported by from_tick_store only
+tick_store_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "How to import large dataset")
+if tick_store_folder not in sys.path:
+    sys.path.append(tick_store_folder)
+
+
+def segment_lengths(starts, stop):
+    """
+    Length of each contiguous segment values[starts[i]:starts[i+1]], the last
+    one finishing at stop (excluded).
+    """
+    return np.diff(np.append(starts, stop))
+
+
+def segment_first_position(mask, starts, stop):
+    """
+    Position of the first True value of the mask in each segment (stop when the
+    segment has no True value).
+    """
+    if len(starts) == 0:
+        return np.array([], dtype="int64")
+    candidates = np.where(mask[:stop], np.arange(stop), stop)
+    return np.minimum.reduceat(candidates, starts)
+
+
+def segment_sum(values, starts, stop):
+    """
+    Sum of each contiguous segment of values
+    """
+    if len(starts) == 0:
+        return values[:0]
+    return np.add.reduceat(values[:stop], starts)
+
+
+def segment_ohlc(values, starts, stop):
+    """
+    Compute in one pass the open, high, low, close of each contiguous segment of
+    values (no empty segment allowed) and the positions of the first high and
+    the first low (same convention as Series.idxmax and Series.idxmin).
+    """
+    values = values[:stop]
+    if len(starts) == 0:
+        empty_positions = np.array([], dtype="int64")
+        return values[:0], values[:0], values[:0], values[:0], empty_positions, empty_positions
+
+    # The values before the first segment are not part of any segment
+    if starts[0] > 0:
+        ohlc = segment_ohlc(values[starts[0]:], starts - starts[0], stop - starts[0])
+        return ohlc[:4] + (ohlc[4] + starts[0], ohlc[5] + starts[0])
+
+    lengths = segment_lengths(starts, stop)
+
+    open_values = values[starts]
+    high_values = np.maximum.reduceat(values, starts)
+    low_values = np.minimum.reduceat(values, starts)
+    close_values = values[starts + lengths - 1]
+
+    # Broadcast the extrema on the ticks to find where they are reached first
+    high_positions = segment_first_position(values == np.repeat(high_values, lengths), starts, stop)
+    low_positions = segment_first_position(values == np.repeat(low_values, lengths), starts, stop)
+
+    return open_values, high_values, low_values, close_values, high_positions, low_positions
+
+
+def merge_segments(ohlc, m, nb):
+    """
+    Merge the segments of segment_ohlc by groups of m consecutive segments (the nb
+    first groups): open, high, low, close and positions of the first high and the
+    first low of each group. The extrema are exact and the first occurrence is kept.
+    """
+    open_values, high_values, low_values, close_values, high_positions, low_positions = \
+        (values[:nb * m].reshape(nb, m) for values in ohlc)
+
+    # argmax and argmin give the first segment which reaches the extremum of the group
+    rows = np.arange(nb)
+    high_segments = high_values.argmax(axis=1)
+    low_segments = low_values.argmin(axis=1)
+
+    return (open_values[:, 0], high_values[rows, high_segments], low_values[rows, low_segments],
+            close_values[:, -1], high_positions[rows, high_segments], low_positions[rows, low_segments])
+
+
+def first_exceedance(cumulated, start, base, threshold, chunk_size=1024):
+    """
+    First position t >= start where |cumulated[t] - base| > threshold (-1 if there
+    is not). The ticks are scanned by vectorized chunks which double in size, so
+    the cost is proportional to the length of the bar and not to the whole dataset.
+    """
+    T = len(cumulated)
+    while start < T:
+        chunk = cumulated[start:start + chunk_size]
+        exceedances = np.flatnonzero(np.abs(chunk - base) > threshold)
+        if len(exceedances) > 0:
+            return start + exceedances[0]
+        start += chunk_size
+        chunk_size *= 2
+    return -1
+
+
+def imbalance_bars_starts(increments, expected_imbalance, ewma_span=None, state=None):
+    """
+    Cut the ticks into imbalance bars: a bar is closed on the first tick where the
+    absolute value of the increments (tick signs, signed volumes...) cumulated since
+    the start of the bar is above the expected imbalance.
+
+    - increments (array): the increment of the imbalance for each tick
+    - expected_imbalance (float): threshold of the bars (of the first one if ewma_span is set)
+    - ewma_span (int): if set, the threshold is updated after each bar like in de Prado's
+      book: E[T] * |E[increment]| where E[T] is an EWMA of the past bars sizes and
+      E[increment] an EWMA of the past bars imbalances divided by their sizes
+    - state (dict): threshold and EWMAs left by a previous call, updated in place, to
+      continue the bars of a previous sequence of increments (streaming)
+
+    Return the position of the first tick of each bar and the position after the
+    last complete bar (the ticks of the last incomplete bar are dropped).
+    """
+    cumulated = np.cumsum(increments)
+    alpha = 2 / (ewma_span + 1) if ewma_span is not None else None
+
+    state = {} if state is None else state
+    threshold = state.get("threshold", abs(expected_imbalance))
+    expected_ticks = state.get("expected_ticks")
+    expected_increment = state.get("expected_increment")
+
+    starts = []
+    start = 0
+    while start < len(cumulated):
+        base = cumulated[start - 1] if start > 0 else 0
+        end = first_exceedance(cumulated, start, base, threshold)
+        if end < 0:
+            break
+        starts.append(start)
+
+        # Update the expected imbalance with the size and imbalance of this bar
+        if alpha is not None:
+            nb_ticks = end - start + 1
+            increment = (cumulated[end] - base) / nb_ticks
+            if expected_ticks is None:
+                expected_ticks, expected_increment = nb_ticks, increment
+            else:
+                expected_ticks = alpha * nb_ticks + (1 - alpha) * expected_ticks
+                expected_increment = alpha * increment + (1 - alpha) * expected_increment
+            threshold = expected_ticks * abs(expected_increment)
+
+        start = end + 1
+
+    state.update({"threshold": threshold, "expected_ticks": expected_ticks, "expected_increment": expected_increment})
+    return np.array(starts, dtype="int64"), start
+
+
+def threshold_bars_starts(values, threshold, cumulated=None):
+    """
+    Cut the ticks into bars which are closed on the first tick where the values
+    (volumes, dollar values...) cumulated since the start of the bar reach the
+    threshold. The values must be positive: the end of each bar is found with a
+    binary search on their cumulative sum.
+
+    - cumulated (array): np.cumsum(values) if it is already computed
+
+    Return the position of the first tick of each bar and the position after the
+    last complete bar (the ticks of the last incomplete bar are dropped).
+    """
+    if threshold <= 0:
+        raise Exception("THRESHOLD must be strictly positive")
+
+    if cumulated is None:
+        cumulated = np.cumsum(values)
+
+    starts = []
+    start = 0
+    while start < len(cumulated):
+        base = cumulated[start - 1] if start > 0 else 0
+        end = np.searchsorted(cumulated, base + threshold, side="left")
+        if end >= len(cumulated):
+            break
+        starts.append(start)
+        start = end + 1
+
+    return np.array(starts, dtype="int64"), start
+
+
+def slippage_prices(timestamps, prices, start_values, window, price_type):
+    """
+    Worst price of each window [start, start + window] with a binary search on the
+    sorted ticks timestamps, the previous price when there is no tick in the window.
+    - timestamps (array): the ticks timestamps in nanoseconds
+    - prices (array): the bid or ask prices of the ticks
+    - start_values (array): the dates of entry in position in nanoseconds
+    """
+    if len(start_values) == 0:
+        return prices[:0]
+
+    # Position of the first tick of each window and position after its last tick
+    lower = np.searchsorted(timestamps, start_values, side="left")
+    upper = np.searchsorted(timestamps, start_values + pd.Timedelta(window).value, side="right")
+
+    # We take the worst case in each window: reduceat on the (lower, upper) pairs
+    # gives the extremum of ticks[lower:upper]. The prices are not copied (memmap or
+    # shared memory), so the indices must stay below T: the windows which end at the
+    # last tick are reduced apart
+    prices = np.asarray(prices)
+    last = len(prices) - 1
+    reduce = np.maximum if price_type == "bid" else np.minimum
+    bounds = np.column_stack([np.minimum(lower, last), np.minimum(upper, last)]).ravel()
+    slippage = reduce.reduceat(prices, bounds)[::2]
+
+    to_end = (upper > last) & (upper > lower)
+    if to_end.any():
+        # Extremum from each position to the last tick, only on the end of the ticks
+        first = lower[to_end].min()
+        suffix = reduce.accumulate(prices[first:][::-1])[::-1]
+        slippage[to_end] = suffix[lower[to_end] - first]
+
+    # There is no ticks in the window, we take the previous value
+    empty = upper <= lower
+    slippage[empty] = prices[lower[empty] - 1]
+
+    return slippage
+
+
+def time_buckets(index, resample_factor):
+    """
+    Assign every tick to its time bucket with the same bins as DataFrame.resample
+    (origin at midnight of the first day, bins closed and labelled on the left).
+    The timeframe must have a fixed duration (s, T, H, D).
+
+    Return the position of the first tick of each non empty bucket, the labels of
+    all the buckets between the first and the last tick (empty ones included) and,
+    for each non empty bucket, its position in the labels.
+    """
+    offset = pd.tseries.frequencies.to_offset(resample_factor)
+    timestamps = index
+
+    # Daily bins follow the wall clock, the other ones the UTC clock
+    if isinstance(offset, pd.tseries.offsets.Day) and timestamps.tz is not None:
+        timestamps = timestamps.tz_localize(None)
+    origin = timestamps[0].normalize()
+
+    # Integer flooring of the nanoseconds since the origin gives the bucket of each tick
+    buckets = (timestamps.asi8 - origin.value) // offset.nanos
+    starts = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+
+    first_label = origin + pd.Timedelta(buckets[0] * offset.nanos)
+    if first_label.tz is None and index.tz is not None:
+        first_label = first_label.tz_localize(index.tz)
+    labels = pd.date_range(first_label, periods=buckets[-1] - buckets[0] + 1, freq=offset,
+                           name=index.name)
+
+    return starts, labels, buckets[starts] - buckets[0]
+
+
+def aggregate_time_bars(base_bars, resample_factor, base_factor, index_dtype="int64"):
+    """
+    Time bars of a timeframe aggregated from the base bars of a finer timeframe which divides it
+    (built with MakeTradingBars.build_time_pyramid): the bars are the same as the bars built from
+    the ticks. The open slippage prices are taken from the base bars with the same label, they are
+    NaN for the labels which are not in the base bars (the first bar can start before the first
+    base bar).
+    - index_dtype: dtype of the index column of the ticks (first_index has the same dtype as in
+      the bars built from the ticks)
+    """
+    offset = pd.tseries.frequencies.to_offset(resample_factor)
+    base_offset = pd.tseries.frequencies.to_offset(base_factor)
+    if not isinstance(offset, pd.tseries.offsets.Tick) or offset.nanos % base_offset.nanos != 0:
+        raise Exception("RESAMPLE_FACTOR must be a multiple of the base timeframe")
+
+    # Only the base bars with ticks are aggregated, the empty ones are created again by the reindex
+    filled = base_bars[base_bars["first_time"].notna()]
+    index = filled.index
+
+    # The daily bins follow the wall clock: the base bins must not cross the midnights of the timezone
+    if isinstance(offset, pd.tseries.offsets.Day) and not isinstance(base_offset, pd.tseries.offsets.Day) and \
+            index.tz is not None and np.any((index.tz_localize(None).asi8 - index.asi8) % base_offset.nanos != 0):
+        raise Exception("The base bars can't be aggregated in days of this timezone")
+
+    # The base bars are the "ticks" of the coarse bars: same bins as time_buckets
+    # The array and not the Series: the name of the Series would replace the name of the index
+    first_times = pd.DatetimeIndex(filled["first_time"].array, name=index.name)
+    starts, labels, label_positions = time_buckets(first_times, offset)
+    stop = len(filled)
+    ends = np.append(starts[1:], stop) - 1
+
+    high_ask, high_positions = segment_ohlc(filled["high_ask"].to_numpy(), starts, stop)[1::3]
+    low_ask, low_positions = segment_ohlc(filled["low_ask"].to_numpy(), starts, stop)[2::3]
+    high_bid = np.maximum.reduceat(filled["high_bid"].to_numpy(), starts)
+    low_bid = np.minimum.reduceat(filled["low_bid"].to_numpy(), starts)
+
+    # When the first tick of the bar is after the bar label, the open is the price of the previous tick
+    first_time = filled["first_time"].array[starts]
+    late_open = labels[label_positions] < first_time
+    open_price = np.where(late_open, filled["previous_mid"].to_numpy()[starts],
+                          filled["first_mid"].to_numpy()[starts])
+
+    time_bars = pd.DataFrame({"open": open_price,
+                              "high": (high_bid + high_ask) / 2,
+                              "low": (low_bid + low_ask) / 2,
+                              "close": filled["close"].to_numpy()[ends],
+                              "volume": segment_sum(filled["volume"].to_numpy(), starts, stop),
+                              "high_time": filled["high_time"].array[high_positions],
+                              "low_time": filled["low_time"].array[low_positions],
+                              "first_index": filled["first_index"].to_numpy()[starts].astype(index_dtype),
+                              "first_time": first_time},
+                             index=labels[label_positions])
+
+    # Empty bars between two ticks are kept with a null volume like in the resampling
+    time_bars = time_bars.reindex(labels)
+    time_bars["volume"] = time_bars["volume"].fillna(0).astype(filled["volume"].dtype)
+
+    # Position of each label in the base bars (-1 if it is not a base label)
+    positions = base_bars.index.get_indexer(labels)
+    for price_type in ["bid", "ask"]:
+        column = f"open_{price_type}_slippage"
+        if column in base_bars.columns:
+            time_bars[column] = np.where(positions >= 0, base_bars[column].to_numpy()[positions], np.nan)
+    return time_bars
+
+
+def bars_from_segments(timestamps, mid_price, volume, starts, stop, columns_values=None):
+    """
+    Create the OHLCV + Timestamp dataframe of the bars defined by the contiguous
+    segments ticks[starts[i]:starts[i+1]] (the last one finishing at stop).
+    - timestamps (DatetimeIndex), mid_price (array), volume (array): the ticks
+    - columns_values (dict): extra columns to insert after the volume
+    """
+    open_price, high_price, low_price, close_price, high_pos, low_pos = segment_ohlc(mid_price, starts, stop)
+
+    bars = pd.DataFrame({"time": timestamps[starts],
+                         "open": open_price,
+                         "high": high_price,
+                         "low": low_price,
+                         "close": close_price,
+                         "volume": segment_sum(volume, starts, stop)})
+
+    for column, values in (columns_values or {}).items():
+        bars[column] = values
+
+    bars["high_time"] = timestamps[high_pos]
+    bars["low_time"] = timestamps[low_pos]
+
+    return bars.set_index("time")
+
+
+def instrumented(stage_name, bars_attribute):
+    """
+    Measure a bar builder with the metrics of the object (see instrumentation.py), nothing
+    is done when self.metrics is None
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.metrics is None:
+                return method(self, *args, **kwargs)
+            with self.metrics.stage(stage_name, ticks=self._length()) as event:
+                result = method(self, *args, **kwargs)
+                event["bars"] = len(getattr(self, bars_attribute))
+            return result
+        return wrapper
+    return decorator
+
 
 class MakeTradingBars:
 
-    def __init__(self, ticks):
+    def __init__(self, ticks, metrics=None, features=None):
         """
 
         NO MISSING VALUES IS MANDATORY !
@@ -14,26 +380,148 @@ class MakeTradingBars:
         Timestamp(as index), bid, ask, volume, index(column from 0
         to number of line with a step of one to make some calculations easily).
 
+        The ticks can also be in the compact representation (int32 points, see compact_ticks.py),
+        the index column is not needed and the bars prices are the same float prices.
+
+        metrics (Metrics): optional, measure the duration of the builders and of the slippage
+        prices (see instrumentation.py), it can also be set later with bars.metrics = ...
+
+        features (list): optional, microstructure features added as columns of the bars by the
+        vectorized builders, in the same pass as the OHLCV (names of aggregators such as "spread",
+        "vwap"... or functions, see bar_features.py)
+
         """
 
+        self.metrics = metrics
+        self.features = features
         self.ticks = ticks
 
-    def make_slippage_price(self, start_date, price_type):
+    @property
+    def ticks(self):
+        # With the arrays constructor or compact ticks, the DataFrame is only created for the
+        # methods which need it (legacy loops)
+        if self._ticks is None and self._arrays is not None:
+            self._ticks = pd.DataFrame({"bid": self._column("bid", "float64"), "ask": self._column("ask", "float64"),
+                                        "volume": self._arrays["volume"], "index": np.arange(self._length())},
+                                       index=self._timestamps())
+        return self._ticks
+
+    @ticks.setter
+    def ticks(self, ticks):
+        self._ticks = ticks
+        self._arrays = None
+        self._digits = None
+        self._derived_arrays = {}
+
+        # The compact ticks are kept as arrays of points
+        if ticks is not None and ticks.attrs.get("digits") is not None:
+            self._ticks = None
+            self._arrays = {"time": ticks.index, "bid": ticks["bid"].to_numpy(), "ask": ticks["ask"].to_numpy(),
+                            "volume": ticks["volume"].to_numpy()}
+            self._tz = ticks.index.tz
+            self._digits = ticks.attrs["digits"]
+
+    @classmethod
+    def from_arrays(cls, time, bid, ask, volume, tz="GMT", digits=None):
+        """
+        Build the bars object from NumPy arrays (np.memmap views for example) without copying
+        them into a DataFrame, the vectorized builders work directly on the arrays.
+        - time (array): int64 nanoseconds since epoch (UTC) in chronological order
+        - bid, ask, volume (array): the columns of the ticks
+        - tz (str): timezone of the bars timestamps
+        - digits (int): if set, bid and ask are int numbers of points (price * 10**digits)
+        """
+        bars = cls(None)
+        bars._arrays = {"time": time, "bid": bid, "ask": ask, "volume": volume}
+        bars._tz = tz
+        bars._digits = digits
+        return bars
+
+    @classmethod
+    def from_tick_cache(cls, cache, start=None, end=None):
+        """
+        Build the bars object on the memory-mapped ticks of a TickCache (see tick_cache.py)
+        between start (included) and end (excluded)
         """
-        Find the slipped price of the associated price. There are two parameters:
+        arrays = cache.arrays(start, end)
+        return cls.from_arrays(arrays["time"], arrays["bid"], arrays["ask"], arrays["volume"], cache.tz)
+
+    def _length(self):
+        return len(self._arrays["time"]) if self._arrays is not None else len(self.ticks)
+
+    def _timestamps(self):
+        """
+        DatetimeIndex of the ticks (a view on the time array with the arrays constructor)
+        """
+        if self._arrays is None:
+            return self.ticks.index
+        if isinstance(self._arrays["time"], pd.DatetimeIndex):
+            return self._arrays["time"]
+        dtype = pd.DatetimeTZDtype(tz=self._tz) if self._tz is not None else np.dtype("datetime64[ns]")
+        values = pd.arrays.DatetimeArray(np.asarray(self._arrays["time"]).view("datetime64[ns]"), dtype=dtype,
+                                         copy=False)
+        return pd.DatetimeIndex(values, copy=False, name="time")
+
+    def _column(self, column, dtype=None):
+        """
+        NumPy array of a column of the ticks (bid, ask, volume or index), without copy when possible
+        """
+        if self._arrays is None:
+            return self.ticks[column].to_numpy(dtype=dtype)
+        if column == "index":
+            return np.arange(self._length())
+        values = np.asarray(self._arrays[column])
+        if dtype is not None and self._digits is not None and column in ["bid", "ask"]:
+            return self._decode(values)
+        return values if dtype is None else values.astype(dtype, copy=False)
+
+    def _prices(self, column):
+        """
+        Bid or ask prices in their stored unit: int numbers of points for the compact ticks,
+        float otherwise. The max, min and first are the same in both units, so they are
+        computed on the stored prices and decoded at the end.
+        """
+        return self._column(column) if self._digits is not None else self._column(column, "float64")
+
+    def _decode(self, values):
+        """
+        Float prices from prices in their stored unit
+        """
+        return values / 10 ** self._digits if self._digits is not None else values
+
+    @classmethod
+    def from_tick_store(cls, symbol, start=None, end=None, root="DATA", broker="Admiral-Markets"):
+        """
+        Build the bars object from the ticks of the tick store (see tick_store.py) between
+        start (included) and end (excluded), only the needed columns are read.
+        """
+        from tick_store import load_ticks
+
+        ticks = load_ticks(symbol, start, end, columns=["bid", "ask", "volume"], root=root, broker=broker)
+
+        # MT5 does not give the volume of every symbol
+        if "volume" not in ticks.columns:
+            ticks["volume"] = 0
+        ticks["index"] = np.arange(len(ticks))
+        return cls(ticks)
+
+    def make_slippage_price(self, start_date, price_type, window=timedelta(seconds=1)):
+        """
+        Find the slipped price of the associated price. There are three parameters:
         - start_date (Timestamp): the date of entry in position
         - price_type (str): 2 possibilities, 'bid' and 'ask'
+        - window (timedelta): duration after the entry used to find the worst price
         """
         if price_type not in ["bid", "ask"]:
             raise Exception("PRICE_TYPE must be 'bid' or 'ask'")
 
-        # Define Timestamp from the index to 1s later
-        end_date = start_date + timedelta(seconds=1)
+        # Define Timestamp from the index to the end of the window
+        end_date = start_date + window
 
-        # Subsample the ticks from current date to 1s later
+        # Subsample the ticks from current date to the end of the window
         period = self.ticks.loc[start_date:end_date][price_type]
 
-        # We take the worst case using a 1second slippage
+        # We take the worst case in the slippage window
         if len(period) > 0:
             slippage_price = period.max() if price_type == "bid" else period.min()
 
@@ -44,146 +532,294 @@ class MakeTradingBars:
 
         return slippage_price
 
-    def time_bars_building(self, resample_factor="5T"):
+    def make_slippage_prices(self, start_dates, price_type, window=timedelta(seconds=1)):
         """
-        resample_factor: Put a timeframe higher than 10s:
-                s = second - T=minute - H = hour - D = day"
+        Bulk version of make_slippage_price: find the slipped price for all the
+        entry dates at once with a binary search on the sorted ticks timestamps.
+        - start_dates (DatetimeIndex): the dates of entry in position
+        - price_type (str): 2 possibilities, 'bid' and 'ask'
+        - window (timedelta): duration after the entry used to find the worst price
+
+        Return a NumPy array with one slipped price per entry date.
         """
+        if price_type not in ["bid", "ask"]:
+            raise Exception("PRICE_TYPE must be 'bid' or 'ask'")
 
-        # Create an empty dataframe which will contains the bars
-        self.time_bars = pd.DataFrame()
+        prices = self._prices(price_type)
+        return self._decode(slippage_prices(self._derived("time_ns"), prices, pd.DatetimeIndex(start_dates).asi8,
+                                            window, price_type))
 
-        # Sample every Xtime
-        time_bars_bid = self.ticks.bid.resample(resample_factor)
-        time_bars_ask = self.ticks.ask.resample(resample_factor)
-        time_bars_vol = self.ticks.volume.resample(resample_factor)
-        time_bars_inx = self.ticks["index"].resample(resample_factor)
+    def _add_open_slippage(self, bars, window=timedelta(seconds=1)):
+        """
+        Create the columns open_bid_slippage and open_ask_slippage of the bars
+        """
+        with nullcontext() if self.metrics is None else self.metrics.stage("slippage", bars=len(bars)):
+            bars["open_bid_slippage"] = self.make_slippage_prices(bars.index, "bid", window)
+            bars["open_ask_slippage"] = self.make_slippage_prices(bars.index, "ask", window)
 
-        # Dataframe filling
-        self.time_bars["open"] = (time_bars_bid.first() + time_bars_ask.first()) / 2
-        self.time_bars["high"] = (time_bars_bid.max() + time_bars_ask.max()) / 2
-        self.time_bars["low"] = (time_bars_bid.min() + time_bars_ask.min()) / 2
-        self.time_bars["close"] = (time_bars_bid.last() + time_bars_ask.last()) / 2
-        self.time_bars["volume"] = time_bars_vol.sum()
-        self.time_bars["high_time"] = self.ticks.groupby(pd.Grouper(freq=resample_factor))['ask'].idxmax()
-        self.time_bars["low_time"] = self.ticks.groupby(pd.Grouper(freq=resample_factor))['ask'].idxmin()
+    def _time_buckets(self, resample_factor):
+        """
+        Time bucket of every tick, see time_buckets
+        """
+        return time_buckets(self._timestamps(), resample_factor)
 
+    def _time_bars(self, offset, extra=False):
+        """
+        Vectorized time bars of a timeframe with a fixed duration, without the slippage prices
+        - extra (bool): add the columns needed to aggregate the bars in coarser bars (see
+          aggregate_time_bars): bid and ask extrema, mid price of the first tick and of the tick before
+        """
+        starts, labels, label_positions = self._time_buckets(offset)
+        stop = self._length()
+        bid = self._prices("bid")
+        ask = self._prices("ask")
+        volume = self._column("volume")
+        timestamps = self._timestamps()
+        decode = self._decode
 
-        # We fix the problem when the first value of the resampling is after the index time
-        # EX: the first time value tick of the bar is at 16:15:52 but the bar index is 16:00:00. If we keep that, we have a problem
-        self.time_bars["first_index"] = time_bars_inx.first()
-        self.time_bars["first_time"] = time_bars_bid.apply(lambda x: x.index[0] if not x.empty else pd.NaT)
+        # Same price definitions as the resampling: mean of the bid and ask extrema
+        open_ask, high_ask, low_ask, close_ask, high_pos, low_pos = segment_ohlc(ask, starts, stop)
+        high_bid = np.maximum.reduceat(bid, starts)
+        low_bid = np.minimum.reduceat(bid, starts)
+        ends = np.append(starts[1:], stop) - 1
 
-        for idx in self.time_bars.index:
-            if idx < self.time_bars["first_time"][idx]:
-                index = self.ticks.loc[idx:]["index"][0] - 1
-                self.time_bars.loc[idx,"open"] = (self.ticks.iloc[index]["bid"] + self.ticks.iloc[index]["ask"]) / 2
+        # We fix the problem when the first value of the resampling is after the index time
+        # EX: the first time value tick of the bar is at 16:15:52 but the bar index is 16:00:00.
+        # In this case the open is the price of the previous tick
+        open_price = (decode(bid[starts]) + decode(open_ask)) / 2
+        late_open = labels[label_positions] < timestamps[starts]
+        previous = starts[late_open] - 1
+        open_price[late_open] = (decode(bid[previous]) + decode(ask[previous])) / 2
 
-        # Create empty series to fill them with the slippage prices
-        open_bid_slippage = pd.Series(index=self.time_bars.index, dtype='float64')
-        open_ask_slippage = pd.Series(index=self.time_bars.index, dtype='float64')
+        time_bars = pd.DataFrame({"open": open_price,
+                                  "high": (decode(high_bid) + decode(high_ask)) / 2,
+                                  "low": (decode(low_bid) + decode(low_ask)) / 2,
+                                  "close": (decode(bid[ends]) + decode(close_ask)) / 2,
+                                  "volume": segment_sum(volume, starts, stop),
+                                  "high_time": timestamps[high_pos],
+                                  "low_time": timestamps[low_pos],
+                                  "first_index": self._column("index")[starts],
+                                  "first_time": timestamps[starts],
+                                  **self._feature_columns(starts, stop)},
+                                 index=labels[label_positions])
 
-        # Fill empty series with slippage prices
-        for idx in self.time_bars.index:
-            open_bid_slippage[idx] = self.make_slippage_price(idx, "bid")
-            open_ask_slippage[idx] = self.make_slippage_price(idx, "ask")
+        if extra:
+            previous = starts - 1
+            time_bars["high_bid"], time_bars["high_ask"] = decode(high_bid), decode(high_ask)
+            time_bars["low_bid"], time_bars["low_ask"] = decode(low_bid), decode(low_ask)
+            time_bars["first_mid"] = (decode(bid[starts]) + decode(open_ask)) / 2
+            time_bars["previous_mid"] = (decode(bid[previous]) + decode(ask[previous])) / 2
 
-            # Create columns in time_bars dataframe with previous Series
-        self.time_bars["open_bid_slippage"] = open_bid_slippage
-        self.time_bars["open_ask_slippage"] = open_ask_slippage
+        # Empty bars between two ticks are kept with a null volume like in the resampling
+        time_bars = time_bars.reindex(labels)
+        time_bars["volume"] = time_bars["volume"].fillna(0).astype(volume.dtype)
+        return time_bars
 
-    def tick_bars_building(self, N=1000):
+    @instrumented("time_bars", "time_bars")
+    def time_bars_building(self, resample_factor="5T", slippage_window=timedelta(seconds=1), vectorized=True):
         """
-        N(int): number of ticks per candle
+        resample_factor: Put a timeframe higher than 10s:
+                s = second - T=minute - H = hour - D = day"
+        slippage_window(timedelta): window used to compute the open slippage prices
+        vectorized(bool): assign each tick to its bar once and compute all the columns
+                          with segment reductions instead of several resampling passes
+                          (only for timeframes with a fixed duration)
+
+        After build_time_pyramid, the timeframes which are multiples of the base timeframe
+        are aggregated from the base bars instead of the ticks (same bars).
         """
 
-        T = len(self.ticks)
+        offset = pd.tseries.frequencies.to_offset(resample_factor)
+        if vectorized and self._pyramid_compatible(offset, slippage_window):
+            self.time_bars = self._time_bars_from_pyramid(offset)
+            return
 
-        # Future list of lists to create the tick bars dataframe (created later)
-        bars_values = []
+        if vectorized and isinstance(offset, pd.tseries.offsets.Tick):
+            self.time_bars = self._time_bars(offset)
 
-        # We extract the OHLCV + timestamp data each N ticks
-        for i in range(T // N):
-            # Subsample period initialization
-            start_period = N * i
-            end_period = N * (i + 1)
+        else:
+            # The resampling only gives the OHLCV
+            self._check_features(False)
 
-            # Extract Bid price, Ask price and volume for the sample period
-            ticks_sample = self.ticks.iloc[start_period:end_period, :]
-            ticks_sample_price = (ticks_sample["bid"] + ticks_sample["ask"]) / 2
-            ticks_sample_volume = ticks_sample["volume"]
+            # Create an empty dataframe which will contains the bars
+            self.time_bars = pd.DataFrame()
 
-            # Create OHLCV + Timestamp features
-            timestamp = ticks_sample_price.index[0]
-            open_price = ticks_sample_price.iloc[0]
-            high_price = ticks_sample_price.max()
-            low_price = ticks_sample_price.min()
-            close_price = ticks_sample_price.iloc[-1]
-            volume = ticks_sample_volume.sum()
-            high_time = ticks_sample_price.idxmax()
-            low_time = ticks_sample_price.idxmin()
+            # Sample every Xtime
+            time_bars_bid = self.ticks.bid.resample(resample_factor)
+            time_bars_ask = self.ticks.ask.resample(resample_factor)
+            time_bars_vol = self.ticks.volume.resample(resample_factor)
+            time_bars_inx = self.ticks["index"].resample(resample_factor)
 
-            # One line OHLCV + Timestamp data
-            bars_values.append([timestamp, open_price, high_price,
-                                low_price, close_price, volume,
-                                high_time, low_time])
+            # Dataframe filling
+            self.time_bars["open"] = (time_bars_bid.first() + time_bars_ask.first()) / 2
+            self.time_bars["high"] = (time_bars_bid.max() + time_bars_ask.max()) / 2
+            self.time_bars["low"] = (time_bars_bid.min() + time_bars_ask.min()) / 2
+            self.time_bars["close"] = (time_bars_bid.last() + time_bars_ask.last()) / 2
+            self.time_bars["volume"] = time_bars_vol.sum()
+            self.time_bars["high_time"] = self.ticks.groupby(pd.Grouper(freq=resample_factor))['ask'].idxmax()
+            self.time_bars["low_time"] = self.ticks.groupby(pd.Grouper(freq=resample_factor))['ask'].idxmin()
 
-        # Create tick bars dataframe
-        self.tick_bars = pd.DataFrame(bars_values, columns=["time", "open", "high", "low", "close", "volume",
-                                                            "high_time", "low_time"])
-        self.tick_bars = self.tick_bars.set_index("time")
+            # We fix the problem when the first value of the resampling is after the index time
+            # EX: the first time value tick of the bar is at 16:15:52 but the bar index is 16:00:00. If we keep that, we have a problem
+            self.time_bars["first_index"] = time_bars_inx.first()
+            self.time_bars["first_time"] = time_bars_bid.apply(lambda x: x.index[0] if not x.empty else pd.NaT)
 
-        # Create empty series to fill them with the slippage prices
-        open_bid_slippage = pd.Series(index=self.tick_bars.index, dtype='float64')
-        open_ask_slippage = pd.Series(index=self.tick_bars.index, dtype='float64')
+            for idx in self.time_bars.index:
+                if idx < self.time_bars["first_time"][idx]:
+                    index = self.ticks.loc[idx:]["index"][0] - 1
+                    self.time_bars.loc[idx,"open"] = (self.ticks.iloc[index]["bid"] + self.ticks.iloc[index]["ask"]) / 2
 
-        # Fill empty series with slippage prices
-        for idx in self.tick_bars.index:
-            open_bid_slippage[idx] = self.make_slippage_price(idx, "bid")
-            open_ask_slippage[idx] = self.make_slippage_price(idx, "ask")
 
-            # Create columns in time_bars dataframe with previous Series
-        self.tick_bars["open_bid_slippage"] = open_bid_slippage
-        self.tick_bars["open_ask_slippage"] = open_ask_slippage
+        # Create columns in the bars dataframe with the slippage prices
+        self._add_open_slippage(self.time_bars, slippage_window)
 
+    def build_time_pyramid(self, base_factor="1T", slippage_window=timedelta(seconds=1)):
+        """
+        Build the base bars of the pyramid mode from the ticks (1 minute bars for example):
+        then time_bars_building aggregates the coarser timeframes (5T, 1H, 4H, D...) from these
+        bars, without reading the ticks again.
+        - base_factor: timeframe of the base bars (fixed duration)
+        - slippage_window(timedelta): window of the open slippage prices, the timeframes built with
+          another window are built from the ticks
 
-    def tick_run_bars_building(self, expected_imbalance=100):
+        The base bars are kept in self.base_time_bars with the extra columns needed to aggregate
+        them exactly (see aggregate_time_bars), they can be saved and given to aggregate_time_bars.
+        The features can't be aggregated: with features, the bars are built from the ticks.
+        """
+        offset = pd.tseries.frequencies.to_offset(base_factor)
+        if not isinstance(offset, pd.tseries.offsets.Tick):
+            raise Exception("BASE_FACTOR must have a fixed duration (s, T, H, D)")
 
-        # Create tick sign: -1 if var<0 and 1 if var>0
-        self.ticks["price"] = (self.ticks.bid + self.ticks.ask) / 2
-        #print(self.ticks)
-        self.ticks["sign_var"] = np.sign(self.ticks.price.pct_change(1))
-        self.ticks = self.ticks.dropna()
+        self.base_time_bars = self._time_bars(offset, extra=True)
+        self._add_open_slippage(self.base_time_bars, slippage_window)
+        self._pyramid = (offset, pd.Timedelta(slippage_window))
 
-        # Parameters initialization
-        start_date = self.ticks.index[0]
-        bars_values = []
-        rolling = False  # Allows us to obtain the start and end dates for each subsample
-        nb_ticks = 0
-        current_imbalance = 0
+    def _pyramid_compatible(self, offset, slippage_window):
+        """
+        The bars of this timeframe can be aggregated from the base bars: multiple of the base
+        timeframe, same slippage window and integer volumes (the float sums would be rounded
+        differently)
+        """
+        if getattr(self, "_pyramid", None) is None or not isinstance(offset, pd.tseries.offsets.Tick) or \
+                self.features:
+            return False
+        base_offset, base_window = self._pyramid
+        return offset.nanos % base_offset.nanos == 0 and pd.Timedelta(slippage_window) == base_window and \
+            np.issubdtype(self.base_time_bars["volume"].dtype, np.integer)
 
-        for idx, sign in zip(self.ticks.index, self.ticks.sign_var):
+    def _time_bars_from_pyramid(self, offset):
+        """
+        Time bars aggregated from the base bars of the pyramid, the slippage prices of the labels
+        which are not labels of the base bars (the first bar) are computed on the ticks
+        """
+        base_offset, slippage_window = self._pyramid
+        time_bars = aggregate_time_bars(self.base_time_bars, offset, base_offset, self._column("index").dtype)
 
-            # Reset the start_date after a complete bar
-            if rolling:
-                rolling = False
-                start_date = idx
-                current_imbalance = 0
-                nb_ticks = 0
+        missing = time_bars["open_bid_slippage"].isna().to_numpy()
+        if missing.any():
+            for price_type in ["bid", "ask"]:
+                time_bars.loc[missing, f"open_{price_type}_slippage"] = \
+                    self.make_slippage_prices(time_bars.index[missing], price_type, slippage_window)
+        return time_bars
 
-            # Increments the imbalance by the sign of this tick
-            current_imbalance += sign
+    def _derived(self, name):
+        """
+        Array derived from the ticks, computed the first time it is needed and shared by all
+        the builders (the ticks are never modified). The arrays are read only.
+        - name (str): time_ns (sorted timestamps in nanoseconds), mid_price, tick_sign,
+                      cum_volume, cum_dollar_value, signed_volume or signed_dollar_value
+        """
+        if name not in self._derived_arrays:
+            if name == "time_ns":
+                values = self._timestamps().asi8
+            elif name == "mid_price":
+                values = (self._column("bid", "float64") + self._column("ask", "float64")) / 2
+            elif name == "tick_sign":
+                # -1 if var<0, 1 if var>0 and 0 for the first tick or if the mid price did not move
+                mid_price = self._derived("mid_price")
+                values = np.sign(np.diff(mid_price, prepend=mid_price[:1])).astype("int8")
+            elif name == "cum_volume":
+                values = np.cumsum(self._column("volume", "float64"))
+            elif name == "cum_dollar_value":
+                values = np.cumsum(self._derived("mid_price") * self._column("volume", "float64"))
+            elif name == "signed_volume":
+                values = self._derived("tick_sign") * self._column("volume", "float64")
+            elif name == "signed_dollar_value":
+                values = self._derived("tick_sign") * self._derived("mid_price") * self._column("volume", "float64")
+            else:
+                raise Exception(f"Unknown derived array {name}")
+
+            values = values.view()
+            values.flags.writeable = False
+            self._derived_arrays[name] = values
 
-            # Recrods the number of ticks (in the bar)
-            nb_ticks += 1
+        return self._derived_arrays[name]
 
-            # Create a candle when the current imbalance is significative
-            if abs(current_imbalance) > abs(expected_imbalance):
-                # Define end_date for this bar
-                end_date = idx
+    def _mid_price(self):
+        """
+        Mid price of every tick as a contiguous NumPy array
+        """
+        return self._derived("mid_price")
+
+    def _bars_from_segments(self, starts, stop, columns_values=None):
+        """
+        Create the OHLCV + Timestamp dataframe of the bars defined by the contiguous
+        segments ticks[starts[i]:starts[i+1]] (the last one finishing at stop).
+        - columns_values (dict): extra columns to insert after the volume (the features too)
+        """
+        columns_values = dict(columns_values or {}, **self._feature_columns(starts, stop))
+        return bars_from_segments(self._timestamps(), self._mid_price(), self._column("volume"),
+                                  starts, stop, columns_values)
+
+    def _feature_columns(self, starts, stop):
+        """
+        Columns of the features of the bars defined by the segments of ticks (see bar_features.py)
+        """
+        if not self.features:
+            return {}
+        from bar_features import compute_features
+        return compute_features(self.features, self, starts, stop)
+
+    def _check_features(self, vectorized):
+        if self.features and not vectorized:
+            raise Exception("FEATURES are only available with vectorized=True")
+
+    def _tick_bars(self, N):
+        """
+        Vectorized tick bars, without the slippage prices
+        """
+        # Each bar is a contiguous block of N ticks, the last incomplete one is dropped
+        T = self._length()
+        starts = np.arange(0, (T // N) * N, N)
+        return self._bars_from_segments(starts, (T // N) * N)
+
+    @instrumented("tick_bars", "tick_bars")
+    def tick_bars_building(self, N=1000, vectorized=True, slippage_window=timedelta(seconds=1)):
+        """
+        N(int): number of ticks per candle
+        vectorized(bool): compute all the bars at once with segment reductions over
+                          NumPy arrays instead of slicing the ticks bar by bar
+        slippage_window(timedelta): window used to compute the open slippage prices
+        """
+
+        T = self._length()
+        self._check_features(vectorized)
+
+        if vectorized:
+            self.tick_bars = self._tick_bars(N)
+
+        else:
+            # Future list of lists to create the tick bars dataframe (created later)
+            bars_values = []
+
+            # We extract the OHLCV + timestamp data each N ticks
+            for i in range(T // N):
+                # Subsample period initialization
+                start_period = N * i
+                end_period = N * (i + 1)
 
                 # Extract Bid price, Ask price and volume for the sample period
-                ticks_sample = self.ticks.loc[start_date:end_date, :]
+                ticks_sample = self.ticks.iloc[start_period:end_period, :]
                 ticks_sample_price = (ticks_sample["bid"] + ticks_sample["ask"]) / 2
                 ticks_sample_volume = ticks_sample["volume"]
 
@@ -199,27 +835,297 @@ class MakeTradingBars:
 
                 # One line OHLCV + Timestamp data
                 bars_values.append([timestamp, open_price, high_price,
-                                    low_price, close_price, volume, nb_ticks,
+                                    low_price, close_price, volume,
                                     high_time, low_time])
 
-                # We activate the rolling to change the start date for the new bar
-                rolling = True
+            # Create tick bars dataframe
+            self.tick_bars = pd.DataFrame(bars_values, columns=["time", "open", "high", "low", "close", "volume",
+                                                                "high_time", "low_time"])
+            self.tick_bars = self.tick_bars.set_index("time")
+
+        # Create columns in the bars dataframe with the slippage prices
+        self._add_open_slippage(self.tick_bars, slippage_window)
+
+
+    def _tick_run_bars(self, expected_imbalance, ewma_span=None):
+        """
+        Vectorized tick run bars, without the slippage prices
+        """
+        # Bars are built from the positions of the ticks, duplicated timestamps are not an issue.
+        # The first tick has no variation, so the bars start at the second tick
+        tick_sign = self._derived("tick_sign")
+        starts, stop = imbalance_bars_starts(tick_sign[1:], expected_imbalance, ewma_span)
+        starts, stop = starts + 1, stop + 1
+        return self._bars_from_segments(starts, stop, {"number_ticks": segment_lengths(starts, stop)})
+
+    @instrumented("tick_run_bars", "tick_run_bars")
+    def tick_run_bars_building(self, expected_imbalance=100, slippage_window=timedelta(seconds=1),
+                               vectorized=True, ewma_span=None):
+        """
+        expected_imbalance(int): a new bar is created when the cumulated tick signs exceed it
+        slippage_window(timedelta): window used to compute the open slippage prices
+        vectorized(bool): find the bars with a single positional pass and compute them with
+                          segment reductions instead of slicing the ticks by dates
+        ewma_span(int): adapt the expected imbalance after each bar with an EWMA of the past
+                        bars (de Prado's tick imbalance bars), only with vectorized=True
+        """
+
+        if ewma_span is not None and not vectorized:
+            raise Exception("EWMA_SPAN is only available with vectorized=True")
+        self._check_features(vectorized)
+
+        # Tick sign: -1 if var<0 and 1 if var>0. The first tick has no variation,
+        # so the bars start at the second tick
+        tick_sign = self._derived("tick_sign")
+
+        if vectorized:
+            self.tick_run_bars = self._tick_run_bars(expected_imbalance, ewma_span)
+
+        else:
+            # The ticks from the second one with their sign (a new DataFrame, self.ticks is not modified)
+            ticks = self.ticks.iloc[1:].assign(sign_var=tick_sign[1:])
+
+            # Parameters initialization
+            start_date = ticks.index[0]
+            bars_values = []
+            rolling = False  # Allows us to obtain the start and end dates for each subsample
+            nb_ticks = 0
+            current_imbalance = 0
+
+            for idx, sign in zip(ticks.index, ticks.sign_var):
+
+                # Reset the start_date after a complete bar
+                if rolling:
+                    rolling = False
+                    start_date = idx
+                    current_imbalance = 0
+                    nb_ticks = 0
+
+                # Increments the imbalance by the sign of this tick
+                current_imbalance += sign
+
+                # Recrods the number of ticks (in the bar)
+                nb_ticks += 1
+
+                # Create a candle when the current imbalance is significative
+                if abs(current_imbalance) > abs(expected_imbalance):
+                    # Define end_date for this bar
+                    end_date = idx
+
+                    # Extract Bid price, Ask price and volume for the sample period
+                    ticks_sample = ticks.loc[start_date:end_date, :]
+                    ticks_sample_price = (ticks_sample["bid"] + ticks_sample["ask"]) / 2
+                    ticks_sample_volume = ticks_sample["volume"]
+
+                    # Create OHLCV + Timestamp features
+                    timestamp = ticks_sample_price.index[0]
+                    open_price = ticks_sample_price.iloc[0]
+                    high_price = ticks_sample_price.max()
+                    low_price = ticks_sample_price.min()
+                    close_price = ticks_sample_price.iloc[-1]
+                    volume = ticks_sample_volume.sum()
+                    high_time = ticks_sample_price.idxmax()
+                    low_time = ticks_sample_price.idxmin()
+
+                    # One line OHLCV + Timestamp data
+                    bars_values.append([timestamp, open_price, high_price,
+                                        low_price, close_price, volume, nb_ticks,
+                                        high_time, low_time])
+
+                    # We activate the rolling to change the start date for the new bar
+                    rolling = True
+
+            self.tick_run_bars = pd.DataFrame(bars_values,
+                                              columns=["time", "open", "high", "low", "close", "volume", "number_ticks",
+                                                       "high_time", "low_time"])
+            self.tick_run_bars = self.tick_run_bars.set_index("time")
+
+        # Create columns in the bars dataframe with the slippage prices
+        self._add_open_slippage(self.tick_run_bars, slippage_window)
+
+    def _threshold_bars(self, cumulated, threshold):
+        """
+        Create the bars closed when the cumulated values reach the threshold (without the slippage prices)
+        """
+        starts, stop = threshold_bars_starts(None, threshold, cumulated)
+        return self._bars_from_segments(starts, stop, {"number_ticks": segment_lengths(starts, stop)})
+
+    def _imbalance_bars(self, increments, expected_imbalance, ewma_span):
+        """
+        Create the bars closed when the cumulated increments exceed the expected imbalance
+        (without the slippage prices)
+        """
+        starts, stop = imbalance_bars_starts(increments, expected_imbalance, ewma_span)
+        return self._bars_from_segments(starts, stop, {"number_ticks": segment_lengths(starts, stop)})
+
+    @instrumented("volume_bars", "volume_bars")
+    def volume_bars_building(self, threshold=1000, slippage_window=timedelta(seconds=1)):
+        """
+        threshold(float): a new bar is created when the cumulated volume reaches it
+        slippage_window(timedelta): window used to compute the open slippage prices
+        """
+        self.volume_bars = self._threshold_bars(self._derived("cum_volume"), threshold)
+        self._add_open_slippage(self.volume_bars, slippage_window)
+
+    @instrumented("dollar_bars", "dollar_bars")
+    def dollar_bars_building(self, threshold=1000000, slippage_window=timedelta(seconds=1)):
+        """
+        threshold(float): a new bar is created when the cumulated dollar value (mid price * volume) reaches it
+        slippage_window(timedelta): window used to compute the open slippage prices
+        """
+        self.dollar_bars = self._threshold_bars(self._derived("cum_dollar_value"), threshold)
+        self._add_open_slippage(self.dollar_bars, slippage_window)
+
+    @instrumented("volume_imbalance_bars", "volume_imbalance_bars")
+    def volume_imbalance_bars_building(self, expected_imbalance=1000, slippage_window=timedelta(seconds=1),
+                                       ewma_span=None):
+        """
+        expected_imbalance(float): a new bar is created when the cumulated signed volume exceeds it
+        slippage_window(timedelta): window used to compute the open slippage prices
+        ewma_span(int): adapt the expected imbalance after each bar with an EWMA of the past bars
+        """
+        self.volume_imbalance_bars = self._imbalance_bars(self._derived("signed_volume"), expected_imbalance,
+                                                          ewma_span)
+        self._add_open_slippage(self.volume_imbalance_bars, slippage_window)
+
+    @instrumented("dollar_imbalance_bars", "dollar_imbalance_bars")
+    def dollar_imbalance_bars_building(self, expected_imbalance=1000000, slippage_window=timedelta(seconds=1),
+                                       ewma_span=None):
+        """
+        expected_imbalance(float): a new bar is created when the cumulated signed dollar value exceeds it
+        slippage_window(timedelta): window used to compute the open slippage prices
+        ewma_span(int): adapt the expected imbalance after each bar with an EWMA of the past bars
+        """
+        self.dollar_imbalance_bars = self._imbalance_bars(self._derived("signed_dollar_value"), expected_imbalance,
+                                                          ewma_span)
+        self._add_open_slippage(self.dollar_imbalance_bars, slippage_window)
+
+    def _tick_bars_sweep(self, sizes):
+        """
+        Tick bars of several sizes from one pass over the ticks: the ticks are reduced once
+        by blocks of gcd(sizes) ticks, then the blocks are merged into the bars of each size.
+        Return a dict N -> bars without the slippage prices.
+        """
+        T = self._length()
+        block = reduce(gcd, sizes)
+        stop = (T // block) * block
+        block_starts = np.arange(0, stop, block)
+        ohlc = segment_ohlc(self._mid_price(), block_starts, stop)
+
+        # The integer volumes are merged exactly, the float ones are summed again on the ticks
+        # (same rounding as the tick bars)
+        volume = self._column("volume")
+        block_volume = segment_sum(volume, block_starts, stop) if np.issubdtype(volume.dtype, np.integer) else None
+        timestamps = self._timestamps()
+
+        bars = {}
+        for N in sizes:
+            m, nb = N // block, T // N
+            starts = np.arange(0, nb * N, N)
+            open_price, high_price, low_price, close_price, high_pos, low_pos = merge_segments(ohlc, m, nb)
+            if block_volume is not None:
+                bars_volume = block_volume[:nb * m].reshape(nb, m).sum(axis=1, dtype=block_volume.dtype)
+            else:
+                bars_volume = segment_sum(volume, starts, nb * N)
+
+            bars[N] = pd.DataFrame({"time": timestamps[starts],
+                                    "open": open_price,
+                                    "high": high_price,
+                                    "low": low_price,
+                                    "close": close_price,
+                                    "volume": bars_volume,
+                                    "high_time": timestamps[high_pos],
+                                    "low_time": timestamps[low_pos]}).set_index("time")
+        return bars
+
+    def _spec_bars(self, spec):
+        """
+        Bars of one spec of bars_sweep, without the slippage prices
+        """
+        kind, parameter = spec[0], spec[1]
+        ewma_span = spec[2] if len(spec) > 2 else None
+        if kind == "tick":
+            return self._tick_bars(parameter)
+        if kind == "time":
+            return self._time_bars(pd.tseries.frequencies.to_offset(parameter))
+        if kind == "tick_run":
+            return self._tick_run_bars(parameter, ewma_span)
+        if kind == "volume":
+            return self._threshold_bars(self._derived("cum_volume"), parameter)
+        if kind == "dollar":
+            return self._threshold_bars(self._derived("cum_dollar_value"), parameter)
+        if kind == "volume_imbalance":
+            return self._imbalance_bars(self._derived("signed_volume"), parameter, ewma_span)
+        return self._imbalance_bars(self._derived("signed_dollar_value"), parameter, ewma_span)
+
+    def bars_sweep(self, specs, slippage_window=timedelta(seconds=1), max_workers=None):
+        """
+        Build many bar sets in one pass over the shared tick arrays (grid search over the bars
+        definitions) instead of one call of the builders by parameter.
+        - specs (list): tuples (kind, parameter) or (kind, parameter, ewma_span) with kind:
+              tick (N), time (resample_factor, fixed duration only), tick_run (expected imbalance),
+              volume, dollar (threshold), volume_imbalance, dollar_imbalance (expected imbalance)
+          EX: [("tick", 50), ("tick", 100), ("time", "5T"), ("tick_run", 100, 20)]
+        - slippage_window(timedelta): window used to compute the open slippage prices
+        - max_workers(int): threads which build the bars of the different specs at the same time
+          (the NumPy reductions release the GIL), cpu_count() if None
+
+        Return a dict spec -> bars, the same DataFrame as the corresponding builder (the bars are
+        not stored in the attributes of the object):
+        - the derived arrays (mid price, tick signs, cumulated volumes...) are computed once
+        - the tick bars of all the sizes are merged from a single reduction of the ticks
+        - the slippage prices are computed once for the distinct open dates of all the bars
+        """
+        specs = list(dict.fromkeys(specs))
+        kinds = ["tick", "time", "tick_run", "volume", "dollar", "volume_imbalance", "dollar_imbalance"]
+        for spec in specs:
+            if spec[0] not in kinds:
+                raise Exception(f"Unknown bars kind {spec[0]}, KIND must be in {kinds}")
+            if len(spec) > 2 and spec[0] not in ["tick_run", "volume_imbalance", "dollar_imbalance"]:
+                raise Exception(f"EWMA_SPAN is only available for the tick run and imbalance bars: {spec}")
+            if spec[0] == "time" and not isinstance(pd.tseries.frequencies.to_offset(spec[1]),
+                                                    pd.tseries.offsets.Tick):
+                raise Exception(f"The time bars of a sweep need a timeframe with a fixed duration: {spec}")
+
+        with nullcontext({}) if self.metrics is None else self.metrics.stage("bars_sweep", ticks=self._length(),
+                                                                            specs=len(specs)) as event:
+            # The shared arrays are computed before the threads start
+            needed = {"tick_run": ["tick_sign"], "volume": ["cum_volume"], "dollar": ["cum_dollar_value"],
+                      "volume_imbalance": ["signed_volume"], "dollar_imbalance": ["signed_dollar_value"]}
+            for name in ["time_ns", "mid_price"] + [name for spec in specs for name in needed.get(spec[0], [])]:
+                self._derived(name)
+
+            tick_specs = [spec for spec in specs if spec[0] == "tick"]
+            other_specs = [spec for spec in specs if spec[0] != "tick"]
 
-        self.tick_run_bars = pd.DataFrame(bars_values,
-                                          columns=["time", "open", "high", "low", "close", "volume", "number_ticks",
-                                                   "high_time", "low_time"])
-        self.tick_run_bars = self.tick_run_bars.set_index("time")
+            bars = {}
+            # The features are computed on the ticks of each bar, not merged from blocks
+            if len(tick_specs) > 1 and not self.features:
+                tick_bars = self._tick_bars_sweep([spec[1] for spec in tick_specs])
+                bars.update({spec: tick_bars[spec[1]] for spec in tick_specs})
+            else:
+                bars.update({spec: self._tick_bars(spec[1]) for spec in tick_specs})
 
-        # Create empty series to fill them with the slippage prices
-        open_bid_slippage = pd.Series(index=self.tick_run_bars.index, dtype='float64')
-        open_ask_slippage = pd.Series(index=self.tick_run_bars.index, dtype='float64')
+            max_workers = min(max_workers or cpu_count(), max(len(other_specs), 1))
+            if max_workers > 1:
+                with ThreadPoolExecutor(max_workers) as executor:
+                    bars.update(zip(other_specs, executor.map(self._spec_bars, other_specs)))
+            else:
+                bars.update({spec: self._spec_bars(spec) for spec in other_specs})
 
-        # Fill empty series with slippage prices
-        for idx in self.tick_run_bars.index:
-            open_bid_slippage[idx] = self.make_slippage_price(idx, "bid")
-            open_ask_slippage[idx] = self.make_slippage_price(idx, "ask")
+            # One binary search for the distinct open dates of all the bars
+            open_dates = np.unique(np.concatenate([np.array([], dtype="int64")] +
+                                                  [spec_bars.index.asi8 for spec_bars in bars.values()]))
+            with nullcontext() if self.metrics is None else self.metrics.stage("slippage", bars=len(open_dates)):
+                slippage = {price_type: self._decode(slippage_prices(self._derived("time_ns"),
+                                                                     self._prices(price_type), open_dates,
+                                                                     slippage_window, price_type))
+                            for price_type in ["bid", "ask"]}
+            for spec_bars in bars.values():
+                positions = np.searchsorted(open_dates, spec_bars.index.asi8)
+                spec_bars["open_bid_slippage"] = slippage["bid"][positions]
+                spec_bars["open_ask_slippage"] = slippage["ask"][positions]
 
-            # Create columns in time_bars dataframe with previous Series
-        self.tick_run_bars["open_bid_slippage"] = open_bid_slippage
-        self.tick_run_bars["open_ask_slippage"] = open_ask_slippage
+            event["bars"] = sum(len(spec_bars) for spec_bars in bars.values())
 
+        return {spec: bars[spec] for spec in specs}
@@ -0,0 +1,276 @@
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from MakeTradingBars import segment_lengths, segment_ohlc, segment_sum, imbalance_bars_starts, slippage_prices, \
+    bars_from_segments
+
+
+class StreamingBars:
+    """
+    Base of the streaming bar builders: the ticks are given chunk by chunk (one daily file
+    at a time for example) and the bars are returned as soon as they are closed and their
+    open slippage window is complete. Between two chunks, only the ticks of the current
+    bar and of the slippage windows of the bars not returned yet are kept in memory.
+
+    The bars are the same as the batch builders of MakeTradingBars, except when a bar
+    needs the tick before the first tick of the history (empty slippage window or late
+    open of the first bar): the batch builders take the last tick of the history, which
+    is not known yet, so the value is NaN.
+    """
+
+    def __init__(self, slippage_window=timedelta(seconds=1)):
+        self.slippage_window = pd.Timedelta(slippage_window).value
+        self.index = None  # Timestamps of the kept ticks
+        self.ticks = None  # Arrays of the kept ticks by column
+        self.offset = 0  # Position of the first kept tick in the whole history
+        self.bar_start = 0  # Position of the first tick of the current bar in the kept ticks
+        self.pending = None  # Closed bars waiting for the end of their slippage window
+
+    def _prepare(self, index, ticks):
+        """
+        Transform a new chunk of ticks before it is added to the kept ticks
+        """
+        return index, ticks
+
+    def _close_bars(self, final):
+        """
+        Create the bars closed by the kept ticks (all the bars if final) and move bar_start
+        """
+        raise NotImplementedError
+
+    def push(self, ticks):
+        """
+        Add a chunk of ticks (DataFrame with the timestamps as index and the bid, ask and volume
+        columns, in chronological order after the previous chunks) and return the completed bars
+        """
+        if len(ticks) == 0:
+            return None if self.index is None else self._emit(final=False)
+
+        # The compact ticks (int32 points, see compact_ticks.py) are decoded chunk by chunk
+        scale = 10 ** ticks.attrs["digits"] if ticks.attrs.get("digits") is not None else 1
+        index, chunk = self._prepare(ticks.index, {"bid": ticks["bid"].to_numpy(dtype="float64") / scale,
+                                                   "ask": ticks["ask"].to_numpy(dtype="float64") / scale,
+                                                   "volume": ticks["volume"].to_numpy()})
+        if self.index is None:
+            self.index, self.ticks = index, chunk
+        else:
+            self.index = self.index.append(index)
+            self.ticks = {column: np.concatenate([self.ticks[column], values]) for column, values in chunk.items()}
+
+        if len(self.index) == 0:
+            return None
+        self._add_pending(self._close_bars(final=False))
+        return self._emit(final=False)
+
+    def close(self):
+        """
+        End of the ticks: return the last bars
+        """
+        if self.index is None or len(self.index) == 0:
+            return None
+        self._add_pending(self._close_bars(final=True))
+        return self._emit(final=True)
+
+    def stream(self, chunks):
+        """
+        Generator of the completed bars from an iterable of chunks of ticks
+        """
+        for chunk in chunks:
+            bars = self.push(chunk)
+            if bars is not None and len(bars) > 0:
+                yield bars
+
+        bars = self.close()
+        if bars is not None and len(bars) > 0:
+            yield bars
+
+    def _mid_price(self):
+        return (self.ticks["bid"] + self.ticks["ask"]) / 2
+
+    def _add_pending(self, bars):
+        if self.pending is None or len(self.pending) == 0:
+            self.pending = bars
+        elif len(bars) > 0:
+            self.pending = pd.concat([self.pending, bars])
+
+    def _emit(self, final):
+        """
+        Return the pending bars whose slippage window is complete (all of them if final)
+        """
+        timestamps = self.index.asi8
+        labels = self.pending.index.asi8
+
+        # The next ticks are after the last kept tick, they can't be in the windows which end before it
+        n = len(labels) if final else np.searchsorted(labels + self.slippage_window, timestamps[-1], side="left")
+        bars, self.pending = self.pending.iloc[:n].copy(), self.pending.iloc[n:]
+
+        for price_type in ["bid", "ask"]:
+            prices = slippage_prices(timestamps, self.ticks[price_type], labels[:n], self.slippage_window, price_type)
+            if self.offset == 0:
+                prices[timestamps[0] > labels[:n] + self.slippage_window] = np.nan
+            bars[f"open_{price_type}_slippage"] = prices
+
+        self._trim()
+        return bars
+
+    def _trim(self):
+        """
+        Forget the ticks which are not needed anymore: we keep the ticks from the first
+        pending label (or the current bar) and the tick just before them
+        """
+        timestamps = self.index.asi8
+        first_label = self.pending.index.asi8[0] if len(self.pending) > 0 else \
+            timestamps[min(self.bar_start, len(timestamps) - 1)]
+        keep_from = max(min(self.bar_start, np.searchsorted(timestamps, first_label, side="left")) - 1, 0)
+
+        self.index = self.index[keep_from:]
+        self.ticks = {column: values[keep_from:] for column, values in self.ticks.items()}
+        self.offset += keep_from
+        self.bar_start -= keep_from
+
+
+class StreamingTickBars(StreamingBars):
+    """
+    Streaming version of MakeTradingBars.tick_bars_building
+    """
+
+    def __init__(self, N=1000, slippage_window=timedelta(seconds=1)):
+        """
+        N(int): number of ticks per candle
+        slippage_window(timedelta): window used to compute the open slippage prices
+        """
+        super().__init__(slippage_window)
+        self.N = N
+
+    def _close_bars(self, final):
+        # The last incomplete bar is dropped at the end like in the batch builder
+        nb_bars = (len(self.index) - self.bar_start) // self.N
+        starts = self.bar_start + np.arange(nb_bars) * self.N
+        stop = self.bar_start + nb_bars * self.N
+
+        bars = bars_from_segments(self.index, self._mid_price(), self.ticks["volume"], starts, stop)
+        self.bar_start = stop
+        return bars
+
+
+class StreamingTickRunBars(StreamingBars):
+    """
+    Streaming version of MakeTradingBars.tick_run_bars_building
+    """
+
+    def __init__(self, expected_imbalance=100, slippage_window=timedelta(seconds=1), ewma_span=None):
+        """
+        expected_imbalance(int): a new bar is created when the cumulated tick signs exceed it
+        slippage_window(timedelta): window used to compute the open slippage prices
+        ewma_span(int): adapt the expected imbalance after each bar with an EWMA of the past bars
+        """
+        super().__init__(slippage_window)
+        self.expected_imbalance = expected_imbalance
+        self.ewma_span = ewma_span
+        self.state = {}  # Threshold and EWMAs of the imbalance after the last closed bar
+        self.previous_price = None  # Mid price of the last tick of the previous chunk
+
+    def _prepare(self, index, ticks):
+        # Tick sign from the variation of the mid price, 0 for the first tick of the history
+        price = (ticks["bid"] + ticks["ask"]) / 2
+        previous_price = np.append(price[0] if self.previous_price is None else self.previous_price, price[:-1])
+        ticks["tick_sign"] = np.sign(price - previous_price).astype("int8")
+
+        # The first tick has no variation, the bars start at the second tick like in the batch builder
+        if self.previous_price is None:
+            self.bar_start = 1
+        self.previous_price = price[-1]
+        return index, ticks
+
+    def _close_bars(self, final):
+        # The cumulated signs restart at the current bar, the EWMAs continue from the previous bars
+        starts, stop = imbalance_bars_starts(self.ticks["tick_sign"][self.bar_start:], self.expected_imbalance,
+                                             self.ewma_span, self.state)
+        starts, stop = starts + self.bar_start, stop + self.bar_start
+
+        bars = bars_from_segments(self.index, self._mid_price(), self.ticks["volume"], starts, stop,
+                                  {"number_ticks": segment_lengths(starts, stop)})
+        self.bar_start = stop
+        return bars
+
+
+class StreamingTimeBars(StreamingBars):
+    """
+    Streaming version of MakeTradingBars.time_bars_building (timeframes with a fixed duration)
+    """
+
+    def __init__(self, resample_factor="5T", slippage_window=timedelta(seconds=1)):
+        """
+        resample_factor: Put a timeframe higher than 10s:
+                s = second - T=minute - H = hour - D = day"
+        slippage_window(timedelta): window used to compute the open slippage prices
+        """
+        super().__init__(slippage_window)
+        self.offset_time = pd.tseries.frequencies.to_offset(resample_factor)
+        if not isinstance(self.offset_time, pd.tseries.offsets.Tick):
+            raise Exception("RESAMPLE_FACTOR must have a fixed duration (s, T, H, D)")
+        self.origin = None  # Midnight of the first day, origin of the bins
+        self.next_bucket = None  # Bucket of the next bar to create
+
+    def _buckets(self, timestamps):
+        """
+        Bucket of each tick, with the same bins as MakeTradingBars._time_buckets
+        """
+        # Daily bins follow the wall clock, the other ones the UTC clock
+        if isinstance(self.offset_time, pd.tseries.offsets.Day) and timestamps.tz is not None:
+            timestamps = timestamps.tz_localize(None)
+        if self.origin is None:
+            self.origin = timestamps[0].normalize()
+
+        return (timestamps.asi8 - self.origin.value) // self.offset_time.nanos
+
+    def _labels(self, first_bucket, periods):
+        first_label = self.origin + pd.Timedelta(first_bucket * self.offset_time.nanos)
+        if first_label.tz is None and self.index.tz is not None:
+            first_label = first_label.tz_localize(self.index.tz)
+        return pd.date_range(first_label, periods=periods, freq=self.offset_time, name=self.index.name)
+
+    def _close_bars(self, final):
+        buckets = self._buckets(self.index[self.bar_start:])
+        if self.next_bucket is None:
+            self.next_bucket = buckets[0]
+
+        # The bar of the last bucket can still receive ticks from the next chunk
+        nb_closed = len(buckets) if final else np.searchsorted(buckets, buckets[-1], side="left")
+        last_bucket = buckets[-1] if final else buckets[-1] - 1
+        labels = self._labels(self.next_bucket, max(last_bucket - self.next_bucket + 1, 0))
+
+        starts = self.bar_start + np.flatnonzero(np.diff(buckets[:nb_closed], prepend=buckets[0] - 1))
+        stop = self.bar_start + nb_closed
+        label_positions = buckets[starts - self.bar_start] - self.next_bucket
+        bid, ask, volume = self.ticks["bid"], self.ticks["ask"], self.ticks["volume"]
+
+        # Same price definitions as the resampling: mean of the bid and ask extrema
+        open_ask, high_ask, low_ask, close_ask, high_pos, low_pos = segment_ohlc(ask, starts, stop)
+        high_bid, low_bid = segment_ohlc(bid, starts, stop)[1:3]
+        ends = np.append(starts[1:], stop) - 1
+
+        # When the first tick of the bar is after the bar label, the open is the price of the previous tick
+        open_price = (bid[starts] + open_ask) / 2
+        late_open = labels[label_positions] < self.index[starts]
+        previous = starts[late_open] - 1
+        open_price[late_open] = np.where(previous >= 0, self._mid_price()[previous], np.nan)
+
+        bars = pd.DataFrame({"open": open_price,
+                             "high": (high_bid + high_ask) / 2,
+                             "low": (low_bid + low_ask) / 2,
+                             "close": (bid[ends] + close_ask) / 2,
+                             "volume": segment_sum(volume, starts, stop),
+                             "high_time": self.index[high_pos],
+                             "low_time": self.index[low_pos],
+                             "first_index": self.offset + starts,
+                             "first_time": self.index[starts]},
+                            index=labels[label_positions])
+
+        # Empty bars between two ticks are kept with a null volume like in the batch builder
+        bars = bars.reindex(labels)
+        bars["volume"] = bars["volume"].fillna(0).astype(volume.dtype)
+
+        self.next_bucket = last_bucket + 1
+        self.bar_start = stop
+        return bars
@@ -0,0 +1,278 @@
+"""
+On-disk cache of the bars built from the tick store, one folder by symbol, bar kind and parameters:
+    {cache_root}/{key}/manifest.json     parameters, fingerprint of each tick partition, checkpoints
+    {cache_root}/{key}/bars.parquet      the bars (typed, the dtypes and timezone are kept)
+    {cache_root}/{key}/state-{i}.pkl     streaming builder after the partition i (checkpoint)
+
+The time (fixed duration), tick and tick run bars are built with the streaming builders, so
+when partitions are added or rewritten only the partitions from the first changed one are read
+again: the builder is restarted from the last checkpoint before it (the last partition of each
+month and the two last partitions are checkpoints). The other bars are rebuilt from all the
+ticks when a partition changed.
+"""
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+import sys
+import time
+from contextlib import nullcontext
+from datetime import timedelta
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "How to import large dataset"))
+from tick_store import symbol_folder, list_partitions, read_partition, to_ticks
+from MakeTradingBars import MakeTradingBars
+from StreamingTradingBars import StreamingTickBars, StreamingTickRunBars, StreamingTimeBars
+
+BAR_KINDS = ["time", "tick", "tick_run", "volume", "dollar", "volume_imbalance", "dollar_imbalance"]
+
+
+def partition_fingerprint(path):
+    """
+    Fingerprint of a partition from its parquet footer (number of rows, sizes and statistics
+    of the row groups...) and its size: the ticks are not read, but a partition rewritten with
+    other ticks has another fingerprint
+    """
+    with open(path, "rb") as file:
+        file.seek(-8, os.SEEK_END)
+        footer_length = int.from_bytes(file.read(4), "little")
+        file.seek(-8 - footer_length, os.SEEK_END)
+        footer = file.read(footer_length)
+    return hashlib.sha1(footer + str(os.path.getsize(path)).encode()).hexdigest()
+
+
+def partition_month(path):
+    """
+    Month of a partition: the folder {year}/{month} of a daily file or the compacted month itself
+    """
+    folder = os.path.dirname(path)
+    return folder if len(os.path.basename(folder)) == 2 else path
+
+
+def builder_parameters(kind, parameters):
+    """
+    Parameters of the builder of this kind of bars with their default values, so the same bars
+    asked with or without the default values have the same key
+    """
+    if kind not in BAR_KINDS:
+        raise Exception(f"KIND must be in {BAR_KINDS}")
+    signature = inspect.signature(getattr(MakeTradingBars, f"{kind}_bars_building"))
+    arguments = signature.bind_partial(None, **parameters)
+    arguments.apply_defaults()
+    return {name: value for name, value in list(arguments.arguments.items())[1:]
+            if name not in ["slippage_window", "vectorized"]}
+
+
+def streaming_builder(kind, parameters, slippage_window):
+    """
+    Streaming builder of the bars (None if this kind of bars has no streaming version)
+    """
+    if kind == "time" and isinstance(pd.tseries.frequencies.to_offset(parameters["resample_factor"]),
+                                     pd.tseries.offsets.Tick):
+        return StreamingTimeBars(parameters["resample_factor"], slippage_window)
+    if kind == "tick":
+        return StreamingTickBars(parameters["N"], slippage_window)
+    if kind == "tick_run":
+        return StreamingTickRunBars(parameters["expected_imbalance"], slippage_window, parameters["ewma_span"])
+    return None
+
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+
+
+class BarCache:
+
+    def __init__(self, cache_root="BARS_CACHE", max_bytes=2 * 2 ** 30, root="DATA", broker="Admiral-Markets",
+                 metrics=None):
+        """
+        - cache_root (str): folder of the cache
+        - max_bytes (int): size of the cache, the least recently used bars are removed above it
+        - root, broker (str): tick store of the ticks (see tick_store.py)
+        - metrics (Metrics): optional, measure each call as a "bar_cache" stage with the number of
+          partitions read again (see instrumentation.py)
+        """
+        self.cache_root = cache_root
+        self.max_bytes = max_bytes
+        self.root = root
+        self.broker = broker
+        self.metrics = metrics
+
+    def key(self, symbol, kind, parameters, start=None, slippage_window=timedelta(seconds=1)):
+        """
+        Name of the folder of the bars: the end of the ticks is not in the key, the bars of a
+        longer history continue the cached bars
+        """
+        description = json.dumps({"symbol": symbol, "broker": self.broker, "kind": kind, "parameters": parameters,
+                                  "start": None if start is None else str(pd.Timestamp(start)),
+                                  "slippage_window": pd.Timedelta(slippage_window).value}, sort_keys=True, default=str)
+        return f"{symbol}-{kind}-{hashlib.sha1(description.encode()).hexdigest()[:16]}"
+
+    def bars(self, symbol, kind, start=None, end=None, slippage_window=timedelta(seconds=1), **parameters):
+        """
+        Bars of the ticks of a symbol between start (included) and end (excluded), from the cache
+        when the ticks did not change.
+        - kind (str): time, tick, tick_run, volume, dollar, volume_imbalance or dollar_imbalance
+        - parameters: the parameters of the builder (resample_factor="5T", N=1000, expected_imbalance=100...)
+
+        EX: cache.bars("EURUSD", "tick", N=500)
+        """
+        parameters = builder_parameters(kind, parameters)
+        folder = os.path.join(self.cache_root, self.key(symbol, kind, parameters, start, slippage_window))
+        tick_folder = symbol_folder(symbol, self.root, self.broker)
+        paths = list_partitions(tick_folder, start, end)
+
+        # The first and the last partitions can be cut by start and end
+        partitions = []
+        for i, path in enumerate(paths):
+            bounds = [str(start) if i == 0 and start is not None else None,
+                      str(end) if i == len(paths) - 1 and end is not None else None]
+            partitions.append([os.path.relpath(path, tick_folder), partition_fingerprint(path), bounds])
+
+        manifest = self._read_manifest(folder)
+        unchanged = 0
+        if manifest is not None:
+            while unchanged < min(len(partitions), len(manifest["partitions"])) and \
+                    partitions[unchanged] == manifest["partitions"][unchanged]:
+                unchanged += 1
+
+        with nullcontext({}) if self.metrics is None else self.metrics.stage("bar_cache", symbol=symbol,
+                                                                            kind=kind) as event:
+            if manifest is not None and unchanged == len(partitions) == len(manifest["partitions"]):
+                event["partitions"] = 0
+                bars = pd.read_parquet(os.path.join(folder, "bars.parquet"))
+                self._touch(folder, manifest)
+                return bars
+
+            builder = streaming_builder(kind, parameters, slippage_window)
+            if builder is None:
+                event["partitions"] = len(paths)
+                bars = self._build(symbol, kind, parameters, start, end, slippage_window)
+                manifest = {"checkpoints": {}}
+            else:
+                # Last checkpoint of the cache before the first changed partition
+                checkpoints = {} if manifest is None else \
+                    {int(i): emitted for i, emitted in manifest["checkpoints"].items() if int(i) < unchanged}
+                event["partitions"] = len(paths) - (max(checkpoints) + 1 if checkpoints else 0)
+                bars, checkpoints = self._stream(folder, builder, paths, start, end, checkpoints)
+                manifest = {"checkpoints": checkpoints}
+
+            manifest.update({"symbol": symbol, "broker": self.broker, "kind": kind, "parameters": parameters,
+                             "start": None if start is None else str(start), "partitions": partitions,
+                             "bars": len(bars)})
+            self._write(folder, bars, manifest)
+            event["bars"] = len(bars)
+
+        self._evict(keep=folder)
+        return bars
+
+    def _build(self, symbol, kind, parameters, start, end, slippage_window):
+        """
+        Bars built with MakeTradingBars on all the ticks (bars without a streaming version)
+        """
+        trading_bars = MakeTradingBars.from_tick_store(symbol, start, end, root=self.root, broker=self.broker)
+        getattr(trading_bars, f"{kind}_bars_building")(slippage_window=slippage_window, **parameters)
+        return getattr(trading_bars, f"{kind}_bars")
+
+    def _stream(self, folder, builder, paths, start, end, checkpoints):
+        """
+        Push the partitions in the streaming builder from the last valid checkpoint and save the
+        new checkpoints. Return the bars and the checkpoints {partition: number of bars emitted}.
+        """
+        chunks = []
+        first = 0
+        if checkpoints:
+            # The builder restarts after the checkpoint with the bars emitted before it
+            last = max(checkpoints)
+            with open(os.path.join(folder, f"state-{last}.pkl"), "rb") as file:
+                builder = pickle.load(file)
+            chunks.append(pd.read_parquet(os.path.join(folder, "bars.parquet")).iloc[:checkpoints[last]])
+            first = last + 1
+
+        emitted = sum(len(chunk) for chunk in chunks)
+        months = [partition_month(path) for path in paths]
+        for i in range(first, len(paths)):
+            table = read_partition(paths[i], start, end)
+            if table is not None and table.num_rows > 0:
+                ticks = to_ticks(table)
+                # MT5 does not give the volume of every symbol
+                if "volume" not in ticks.columns:
+                    ticks["volume"] = 0
+                bars = builder.push(ticks)
+                if bars is not None and len(bars) > 0:
+                    chunks.append(bars)
+                    emitted += len(bars)
+
+            # Checkpoint after the last partition of each month and the two last partitions
+            if i >= len(paths) - 2 or months[i] != months[i + 1]:
+                os.makedirs(folder, exist_ok=True)
+                with open(os.path.join(folder, f"state-{i}.pkl.tmp"), "wb") as file:
+                    pickle.dump(builder, file)
+                os.replace(os.path.join(folder, f"state-{i}.pkl.tmp"), os.path.join(folder, f"state-{i}.pkl"))
+                checkpoints[i] = emitted
+
+        bars = builder.close()
+        if bars is not None and len(bars) > 0:
+            chunks.append(bars)
+        if not chunks:
+            return pd.DataFrame(), checkpoints
+        return pd.concat(chunks), checkpoints
+
+    def _read_manifest(self, folder):
+        path = os.path.join(folder, "manifest.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as file:
+            return json.load(file)
+
+    def _write_manifest(self, folder, manifest):
+        path = os.path.join(folder, "manifest.json")
+        with open(path + ".tmp", "w") as file:
+            json.dump(manifest, file, default=str)
+        os.replace(path + ".tmp", path)
+
+    def _touch(self, folder, manifest):
+        manifest["used"] = time.time()
+        self._write_manifest(folder, manifest)
+
+    def _write(self, folder, bars, manifest):
+        """
+        Write the bars and the manifest (the manifest is written last: a folder without a valid
+        manifest is never read) and remove the checkpoints which are not used anymore
+        """
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, "bars.parquet")
+        bars.to_parquet(path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+        checkpoints = {str(i) for i in manifest["checkpoints"]}
+        for name in os.listdir(folder):
+            if name.startswith("state-") and name.endswith(".pkl") and name[6:-4] not in checkpoints:
+                os.remove(os.path.join(folder, name))
+        self._touch(folder, manifest)
+
+    def _evict(self, keep=None):
+        """
+        Remove the least recently used bars until the cache is smaller than max_bytes
+        """
+        entries = []
+        for name in os.listdir(self.cache_root) if os.path.isdir(self.cache_root) else []:
+            folder = os.path.join(self.cache_root, name)
+            manifest = self._read_manifest(folder) if os.path.isdir(folder) else None
+            used = manifest.get("used", 0) if manifest is not None else 0
+            entries.append((used, folder, folder_size(folder)))
+
+        total = sum(size for _, _, size in entries)
+        for used, folder, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if folder == keep:
+                continue
+            shutil.rmtree(folder)
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.cache_root):
+            shutil.rmtree(self.cache_root)
@@ -0,0 +1,170 @@
+"""
+Microstructure features of the bars, computed by the vectorized builders of MakeTradingBars
+in the same pass as the OHLCV, on the same segments of ticks:
+    bars = MakeTradingBars(ticks, features=["spread", "vwap", "realised_variance"])
+    bars.tick_bars_building(1000)  # bars.tick_bars has the columns mean_spread, max_spread, vwap...
+
+A feature is an aggregator function(ticks, starts, stop) which returns a dict {column: values}
+with one value per bar, the bars being the segments ticks[starts[i]:starts[i+1]] (the last one
+finishing at stop, no empty segment). ticks gives the arrays of the ticks: ticks["bid"], "ask",
+"mid", "volume", "time_ns", "tick_sign", "spread" or "log_mid" (float64, computed the first time
+they are used). New features are registered with a name:
+
+    @register_feature("mid_range")
+    def mid_range(ticks, starts, stop):
+        return {"mid_range": segment_max(ticks["mid"], starts, stop) - segment_min(ticks["mid"], starts, stop)}
+
+or given directly as functions in the list of features.
+"""
+import numpy as np
+from MakeTradingBars import segment_lengths, segment_ohlc, segment_sum
+
+FEATURES = {}
+
+
+def register_feature(name):
+    """
+    Decorator which registers an aggregator under a name (see the module docstring)
+    """
+    def decorator(function):
+        FEATURES[name] = function
+        return function
+    return decorator
+
+
+def segment_max(values, starts, stop):
+    if len(starts) == 0:
+        return values[:0]
+    return np.maximum.reduceat(values[:stop], starts)
+
+
+def segment_min(values, starts, stop):
+    if len(starts) == 0:
+        return values[:0]
+    return np.minimum.reduceat(values[:stop], starts)
+
+
+def segment_mean(values, starts, stop):
+    return segment_sum(values, starts, stop) / segment_lengths(starts, stop)
+
+
+def within_segments(values, starts):
+    """
+    Copy of values (variations from the previous tick) where the first tick of each segment is
+    0, so the reductions of the segments do not use the variation from the previous segment
+    """
+    values = values.copy()
+    values[starts] = 0
+    return values
+
+
+class FeatureTicks:
+    """
+    Arrays of the ticks given to the aggregators, the ones which are already memoised by the
+    bars object (mid price, tick signs...) are shared
+    """
+
+    def __init__(self, trading_bars):
+        self.trading_bars = trading_bars
+        self.arrays = {}
+
+    def __getitem__(self, name):
+        if name not in self.arrays:
+            bars = self.trading_bars
+            if name in ["bid", "ask", "volume"]:
+                values = bars._column(name, "float64")
+            elif name == "mid":
+                values = bars._derived("mid_price")
+            elif name in ["time_ns", "tick_sign"]:
+                values = bars._derived(name)
+            elif name == "spread":
+                values = self["ask"] - self["bid"]
+            elif name == "log_mid":
+                values = np.log(self["mid"])
+            else:
+                raise Exception(f"Unknown tick array {name}")
+            self.arrays[name] = values
+        return self.arrays[name]
+
+
+def compute_features(features, trading_bars, starts, stop):
+    """
+    Columns of the features (names of registered aggregators or functions) for the bars
+    defined by the segments of ticks
+    """
+    ticks = FeatureTicks(trading_bars)
+    columns = {}
+    for feature in features:
+        if isinstance(feature, str):
+            if feature not in FEATURES:
+                raise Exception(f"Unknown feature {feature}, FEATURE must be in {list(FEATURES)} or a function")
+            feature = FEATURES[feature]
+        for column, values in feature(ticks, starts, stop).items():
+            if len(values) != len(starts):
+                raise Exception(f"The feature {column} must have one value by bar")
+            columns[column] = values
+    return columns
+
+
+@register_feature("spread")
+def spread(ticks, starts, stop):
+    """
+    Mean and max spread (ask - bid) of the ticks of the bar
+    """
+    return {"mean_spread": segment_mean(ticks["spread"], starts, stop),
+            "max_spread": segment_max(ticks["spread"], starts, stop)}
+
+
+@register_feature("vwap")
+def vwap(ticks, starts, stop):
+    """
+    Mean of the mid prices weighted by the volumes (NaN for a bar without volume)
+    """
+    volume = segment_sum(ticks["volume"], starts, stop)
+    dollar_value = segment_sum(ticks["mid"] * ticks["volume"], starts, stop)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {"vwap": np.where(volume > 0, dollar_value / volume, np.nan)}
+
+
+@register_feature("bid_ask_ohlc")
+def bid_ask_ohlc(ticks, starts, stop):
+    """
+    Open, high, low, close of the bid and of the ask
+    """
+    columns = {}
+    for price_type in ["bid", "ask"]:
+        ohlc = segment_ohlc(ticks[price_type], starts, stop)[:4]
+        for name, values in zip(["open", "high", "low", "close"], ohlc):
+            columns[f"{name}_{price_type}"] = values
+    return columns
+
+
+@register_feature("realised_variance")
+def realised_variance(ticks, starts, stop):
+    """
+    Sum of the squared log returns of the mid price between the ticks of the bar
+    """
+    log_returns = within_segments(np.diff(ticks["log_mid"], prepend=ticks["log_mid"][:1]), starts)
+    return {"realised_variance": segment_sum(log_returns ** 2, starts, stop)}
+
+
+@register_feature("tick_imbalance")
+def tick_imbalance(ticks, starts, stop):
+    """
+    Sum of the tick signs of the bar divided by its number of ticks (between -1 and 1)
+    """
+    return {"tick_imbalance": segment_mean(ticks["tick_sign"].astype("float64"), starts, stop)}
+
+
+@register_feature("inter_arrival")
+def inter_arrival(ticks, starts, stop):
+    """
+    Mean and max duration in seconds between two ticks of the bar (NaN and 0 for a bar of one tick)
+    """
+    time = ticks["time_ns"]
+    lengths = segment_lengths(starts, stop)
+    duration = (time[np.append(starts[1:], stop) - 1] - time[starts]) / 10 ** 9
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(lengths > 1, duration / (lengths - 1), np.nan)
+    gaps = within_segments(np.diff(time, prepend=time[:1]), starts)
+    return {"mean_inter_arrival": mean, "max_inter_arrival": segment_max(gaps, starts, stop) / 10 ** 9}
@@ -0,0 +1,341 @@
+"""
+Local server of bars for the notebooks and the backtests: the ticks of each symbol are loaded
+once and the bars recently asked are kept in memory, so the same bars asked by several processes
+are built once. The bars are sent in the Arrow IPC stream format (columnar, no parsing):
+
+    GET http://127.0.0.1:8765/bars?symbol=EURUSD&kind=tick&N=500&start=2020-01-01&end=2021-01-01
+    GET http://127.0.0.1:8765/stats
+
+The parameters of the query are the parameters of the builder (N, resample_factor, threshold...),
+with slippage_window in seconds and features separated by commas (see bar_features.py). Use
+query_bars from another process to get a DataFrame. The server only listens on the local machine.
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import urlparse, parse_qsl, urlencode
+from urllib.request import urlopen
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "How to import large dataset"))
+from tick_store import symbol_folder, list_partitions, load_ticks, to_gmt
+from instrumentation import Metrics, stage
+from MakeTradingBars import MakeTradingBars
+from bar_cache import builder_parameters
+
+# PARAMETERS
+host = "127.0.0.1"  # Local only
+port = 8765
+root = "DATA"
+broker = "Admiral-Markets"
+max_ticks_bytes = 4 * 2 ** 30  # Memory of the ticks kept in memory, the least recently used symbols are removed above
+max_bars_bytes = 1 * 2 ** 30  # Memory of the bars kept in memory
+version_ttl = 1.0  # Seconds during which the version of the ticks of a symbol is not checked again
+metrics_path = None  # JSON lines file where the duration of every query is written (see instrumentation.py)
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+
+class LRUCache:
+    """
+    Thread-safe dict which removes the least recently used values when the total size of the
+    values is above max_bytes
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.values = OrderedDict()  # key -> (value, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, count_miss=True):
+        """
+        Value of the key (None if it is not in the cache). count_miss=False for a first lookup
+        which is checked again under the lock of the key, so a miss is counted once.
+        """
+        with self.lock:
+            if key not in self.values:
+                if count_miss:
+                    self.misses += 1
+                return None
+            self.hits += 1
+            self.values.move_to_end(key)
+            return self.values[key][0]
+
+    def put(self, key, value, size):
+        with self.lock:
+            if key in self.values:
+                self.size -= self.values.pop(key)[1]
+            self.values[key] = (value, size)
+            self.size += size
+            # The last value is kept even if it is larger than the cache
+            while self.size > self.max_bytes and len(self.values) > 1:
+                self.size -= self.values.popitem(last=False)[1][1]
+
+    def discard(self, condition):
+        """
+        Remove the values whose key satisfies the condition
+        """
+        with self.lock:
+            for key in [key for key in self.values if condition(key)]:
+                self.size -= self.values.pop(key)[1]
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.values), "bytes": self.size, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+
+def store_version(folder):
+    """
+    Version of the ticks of a symbol from the size and date of its partitions (the files are
+    only listed), it changes when a partition is written
+    """
+    description = []
+    for path in list_partitions(folder):
+        status = os.stat(path)
+        description.append(f"{os.path.relpath(path, folder)}:{status.st_size}:{status.st_mtime_ns}")
+    return hashlib.sha1("\n".join(description).encode()).hexdigest()
+
+
+class BarService:
+
+    def __init__(self, root="DATA", broker="Admiral-Markets", max_ticks_bytes=4 * 2 ** 30, max_bars_bytes=2 ** 30,
+                 metrics=None, version_ttl=1.0):
+        """
+        - root, broker (str): tick store of the ticks (see tick_store.py)
+        - max_ticks_bytes, max_bars_bytes (int): memory of the ticks and of the bars kept in memory
+        - metrics (Metrics): optional, measure each query as a "bar_query" stage (see instrumentation.py)
+        - version_ttl (float): seconds during which the version of the ticks of a symbol is reused
+          (the partitions are not listed again), a rewritten partition is seen after this delay
+        """
+        self.root = root
+        self.broker = broker
+        self.ticks = LRUCache(max_ticks_bytes)
+        self.bars_cache = LRUCache(max_bars_bytes)
+        self.metrics = metrics
+        self.locks = {}  # One lock by key, the same bars asked at the same time are built once
+        self.locks_lock = threading.Lock()
+        self.version_ttl = version_ttl
+        self.versions = {}  # symbol -> (time of the check, version)
+
+    @contextmanager
+    def _building(self, key):
+        """
+        Lock of a key while its value is built, the lock is forgotten after the build (the other
+        threads which waited for it find the value in the cache)
+        """
+        with self.locks_lock:
+            lock = self.locks.setdefault(key, threading.Lock())
+        with lock:
+            yield
+            with self.locks_lock:
+                self.locks.pop(key, None)
+
+    def version(self, symbol):
+        """
+        Version of the ticks of a symbol (see store_version), checked again after version_ttl seconds
+        """
+        with self.locks_lock:
+            checked = self.versions.get(symbol)
+        if checked is not None and time.monotonic() - checked[0] < self.version_ttl:
+            return checked[1]
+        version = store_version(symbol_folder(symbol, self.root, self.broker))
+        with self.locks_lock:
+            self.versions[symbol] = (time.monotonic(), version)
+        return version
+
+    def tick_arrays(self, symbol):
+        """
+        Time, bid, ask and volume arrays of all the ticks of a symbol, loaded again when the tick
+        store changed. Return the version of the ticks and the arrays.
+        """
+        version = self.version(symbol)
+        key = (symbol, version)
+        arrays = self.ticks.get(key, count_miss=False)
+        if arrays is not None:
+            return version, arrays
+
+        with self._building(key):
+            arrays = self.ticks.get(key)
+            if arrays is None:
+                ticks = load_ticks(symbol, columns=["bid", "ask", "volume"], root=self.root, broker=self.broker)
+                if len(ticks) == 0:
+                    raise Exception(f"No tick for {symbol} in the tick store")
+                # MT5 does not give the volume of every symbol
+                volume = ticks["volume"].to_numpy() if "volume" in ticks.columns else np.zeros(len(ticks))
+                arrays = {"time": ticks.index.asi8, "bid": ticks["bid"].to_numpy(), "ask": ticks["ask"].to_numpy(),
+                          "volume": volume, "tz": str(ticks.index.tz) if ticks.index.tz is not None else None}
+                # The ticks of the previous versions of the tick store are not used anymore
+                self.ticks.discard(lambda cached: cached[0] == symbol and cached[1] != version)
+                self.ticks.put(key, arrays, sum(values.nbytes for values in arrays.values()
+                                                if isinstance(values, np.ndarray)))
+        return version, arrays
+
+    def bars(self, symbol, kind, start=None, end=None, slippage_window=timedelta(seconds=1), features=None,
+             **parameters):
+        """
+        Bars of the ticks of a symbol between start (included) and end (excluded), the same as
+        MakeTradingBars.from_tick_store(symbol, start, end) and its builder of this kind of bars
+        """
+        # The parameters which are not parameters of the builder are refused (not ignored)
+        names = list(builder_parameters(kind, {}))
+        unknown = [name for name in parameters if name not in names]
+        if unknown:
+            raise Exception(f"Unknown parameters {unknown} for the {kind} bars, the parameters must be in {names}")
+        parameters = builder_parameters(kind, parameters)
+        features = list(features) if features else None
+        version, arrays = self.tick_arrays(symbol)
+        key = json.dumps([symbol, version, kind, parameters, None if start is None else str(to_gmt(start)),
+                          None if end is None else str(to_gmt(end)), pd.Timedelta(slippage_window).value, features],
+                         default=str, sort_keys=True)
+
+        with stage(self.metrics, "bar_query", symbol=symbol, kind=kind) as event:
+            bars = self.bars_cache.get(key, count_miss=False)
+            event["hit"] = bars is not None
+            if bars is None:
+                with self._building(key):
+                    bars = self.bars_cache.get(key)
+                    if bars is None:
+                        bars = self._build(arrays, kind, start, end, slippage_window, features, parameters)
+                        self.bars_cache.put(key, bars, int(bars.memory_usage(index=True).sum()))
+            event["bars"] = len(bars)
+        return bars
+
+    def _build(self, arrays, kind, start, end, slippage_window, features, parameters):
+        # The bars are built on views of the ticks between start and end (no copy)
+        time = arrays["time"]
+        first = 0 if start is None else np.searchsorted(time, to_gmt(start).value, side="left")
+        last = len(time) if end is None else np.searchsorted(time, to_gmt(end).value, side="left")
+        if last <= first:
+            raise Exception("No tick between START and END")
+
+        trading_bars = MakeTradingBars.from_arrays(time[first:last], arrays["bid"][first:last],
+                                                   arrays["ask"][first:last], arrays["volume"][first:last],
+                                                   arrays["tz"])
+        trading_bars.features = features
+        getattr(trading_bars, f"{kind}_bars_building")(slippage_window=slippage_window, **parameters)
+        return getattr(trading_bars, f"{kind}_bars")
+
+    def stats(self):
+        return {"ticks": self.ticks.stats(), "bars": self.bars_cache.stats()}
+
+
+def parse_value(value):
+    """
+    Value of a parameter of the query string: int, float or str
+    """
+    for parse in [int, float]:
+        try:
+            return parse(value)
+        except ValueError:
+            pass
+    return value
+
+
+def write_arrow(bars, file, batch_size=65536):
+    """
+    Write the bars (with their index) in the Arrow IPC stream format, batch by batch
+    """
+    table = pa.Table.from_pandas(bars, preserve_index=True)
+    with pa.ipc.new_stream(file, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=batch_size):
+            writer.write_batch(batch)
+
+
+class BarRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            self._send_json(200, self.server.service.stats())
+            return
+        if url.path != "/bars":
+            self._send_json(404, {"error": f"Unknown path {url.path}, use /bars or /stats"})
+            return
+
+        query = dict(parse_qsl(url.query))
+        try:
+            symbol, kind = query.pop("symbol"), query.pop("kind")
+            arguments = {"start": query.pop("start", None), "end": query.pop("end", None)}
+            if "slippage_window" in query:
+                arguments["slippage_window"] = timedelta(seconds=float(query.pop("slippage_window")))
+            if "features" in query:
+                arguments["features"] = query.pop("features").split(",")
+            parameters = {name: parse_value(value) for name, value in query.items()}
+            bars = self.server.service.bars(symbol, kind, **arguments, **parameters)
+        except Exception as error:
+            self._send_json(400, {"error": repr(error)})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", ARROW_STREAM)
+        self.end_headers()
+        write_arrow(bars, self.wfile)
+
+    def _send_json(self, status, content):
+        body = json.dumps(content, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # The queries are measured with the metrics, the standard error is kept for the errors
+        pass
+
+
+def make_server(service, host="127.0.0.1", port=8765):
+    """
+    HTTP server of the bars of a BarService, one thread by query (serve_forever to start it)
+    """
+    server = ThreadingHTTPServer((host, port), BarRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def query_bars(symbol, kind, start=None, end=None, host="127.0.0.1", port=8765, slippage_window=None, features=None,
+               **parameters):
+    """
+    Client of the bar server: DataFrame of the bars (same arguments as BarService.bars, with
+    slippage_window as a timedelta)
+
+    EX: query_bars("EURUSD", "time", start="2020-01-01", resample_factor="1H", features=["spread"])
+    """
+    query = {"symbol": symbol, "kind": kind, **parameters}
+    for name, value in [("start", start), ("end", end)]:
+        if value is not None:
+            query[name] = str(value)
+    if slippage_window is not None:
+        query["slippage_window"] = pd.Timedelta(slippage_window).total_seconds()
+    if features:
+        query["features"] = ",".join(features)
+
+    try:
+        with urlopen(f"http://{host}:{port}/bars?{urlencode(query)}") as response:
+            return pa.ipc.open_stream(response).read_pandas()
+    except HTTPError as error:
+        raise Exception(json.loads(error.read()).get("error", str(error)))
+
+
+if __name__ == '__main__':
+    metrics = Metrics(metrics_path) if metrics_path else None
+    server = make_server(BarService(root, broker, max_ticks_bytes, max_bars_bytes, metrics, version_ttl), host, port)
+    print(f"Bars served on http://{host}:{port}/bars")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,191 @@
+"""
+Bars of many symbols on all the cores: the ticks of each symbol are loaded once in a block of
+shared memory (time, bid, ask and volume arrays) and the worker processes build the bars on
+views of this block (MakeTradingBars.from_arrays), so the ticks are never pickled. Only the
+bars are sent back to the main process.
+"""
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import timedelta
+from multiprocessing import cpu_count
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "How to import large dataset"))
+from tick_store import load_ticks
+from instrumentation import Metrics, summarize, stage
+from MakeTradingBars import MakeTradingBars
+
+# PARAMETERS
+symbols = ["EURUSD-Z", "GBPUSD-Z", "USDJPY-Z", "AUDCHF-Z"]
+specs = [("tick", 500), ("tick", 1000), ("time", "1H"), ("tick_run", 50)]  # See MakeTradingBars.bars_sweep
+start_date = None  # First date of the ticks, all the ticks of the store if None
+end_date = None
+root = "DATA"
+broker = "Admiral-Markets"
+workers = cpu_count()  # Processes which build the bars
+max_loaded = None  # Symbols in shared memory at the same time (bounds the memory), workers + 1 if None
+output_folder = "Bars"  # The bars are written in {output_folder}/{symbol}-{kind}-{parameter}.parquet
+metrics_path = None  # JSON lines file where the duration of every stage is written (see instrumentation.py)
+
+ARRAYS = {"time": "int64", "bid": "float64", "ask": "float64", "volume": "float64"}
+
+
+def share_ticks(ticks):
+    """
+    Copy the ticks of a DataFrame in a new block of shared memory. Return the block and its
+    description (name, number of ticks, timezone) which is sent to the workers instead of the ticks.
+    """
+    size = len(ticks)
+    block = SharedMemory(create=True, size=max(size * 8 * len(ARRAYS), 1))
+    volume = ticks["volume"] if "volume" in ticks.columns else np.zeros(size)
+    for k, (column, values) in enumerate([("time", ticks.index.asi8), ("bid", ticks["bid"]), ("ask", ticks["ask"]),
+                                          ("volume", volume)]):
+        array = np.ndarray(size, dtype=ARRAYS[column], buffer=block.buf, offset=k * size * 8)
+        array[:] = np.asarray(values, dtype=ARRAYS[column])
+    del array
+
+    tz = str(ticks.index.tz) if ticks.index.tz is not None else None
+    return block, {"name": block.name, "size": size, "tz": tz}
+
+
+def attach_ticks(description):
+    """
+    Views on the arrays of a block created by share_ticks (no copy). Return the block, which
+    must stay open while the arrays are used, and the arrays.
+    """
+    block = SharedMemory(name=description["name"])
+    size = description["size"]
+    arrays = {column: np.ndarray(size, dtype=dtype, buffer=block.buf, offset=k * size * 8)
+              for k, (column, dtype) in enumerate(ARRAYS.items())}
+    return block, arrays
+
+
+def build_bars(description, specs, slippage_window=timedelta(seconds=1), metrics=None):
+    """
+    Build the bars of the specs on the shared ticks of one symbol (in a worker process), see
+    MakeTradingBars.bars_sweep. The bars do not reference the shared memory.
+    """
+    block, arrays = attach_ticks(description)
+    try:
+        trading_bars = MakeTradingBars.from_arrays(arrays["time"], arrays["bid"], arrays["ask"], arrays["volume"],
+                                                   description["tz"])
+        trading_bars.metrics = metrics
+        bars = trading_bars.bars_sweep(specs, slippage_window, max_workers=1)
+    finally:
+        # The views must be released before the block is closed
+        trading_bars = arrays = None
+        block.close()
+    return bars
+
+
+def run_batch(symbols, specs, start=None, end=None, root="DATA", broker="Admiral-Markets", workers=None,
+              max_loaded=None, slippage_window=timedelta(seconds=1), on_result=None, metrics=None):
+    """
+    Build the bars of the specs for every symbol with a pool of processes.
+    - symbols (list): symbols of the tick store (see tick_store.py)
+    - specs (list): bars of each symbol, see MakeTradingBars.bars_sweep
+    - workers (int): processes which build the bars (cpu_count() if None), the specs of a symbol are
+      split between several processes when there are fewer symbols than processes
+    - max_loaded (int): symbols whose ticks are in shared memory at the same time (workers + 1 if None),
+      the next symbol is loaded while the processes work on the previous ones
+    - on_result(symbol, bars): called with the bars of each symbol when they are all built
+      (to write them for example), the bars are not kept in the results if set
+    - metrics (Metrics): optional, the loading of each symbol and the builders are measured
+
+    Return the bars by symbol ({spec: DataFrame}) and the errors by symbol.
+    """
+    workers = workers or cpu_count()
+    max_loaded = max_loaded or workers + 1
+    specs = list(dict.fromkeys(specs))
+    # Split the specs of each symbol to use all the processes when there are few symbols
+    groups = max(1, min(len(specs), workers // max(len(symbols), 1)))
+    spec_groups = [specs[k::groups] for k in range(groups)]
+
+    results, failures = {}, {}
+    loaded = {}  # symbol -> (block, futures not finished yet, bars already built)
+    running = {}  # future -> symbol
+
+    def collect(futures):
+        for future in futures:
+            symbol = running.pop(future)
+            block, pending, bars = loaded[symbol]
+            pending.discard(future)
+            try:
+                bars.update(future.result())
+            except Exception as error:
+                failures[symbol] = repr(error)
+            if pending:
+                continue
+
+            # All the bars of the symbol are built: its shared memory is freed
+            block.close()
+            block.unlink()
+            del loaded[symbol]
+            if symbol in failures:
+                continue
+            bars = {spec: bars[spec] for spec in specs}
+            if on_result is not None:
+                on_result(symbol, bars)
+            else:
+                results[symbol] = bars
+
+    try:
+        with ProcessPoolExecutor(workers) as executor:
+            for symbol in symbols:
+                # Wait for a symbol to finish before loading the next one
+                while len(loaded) >= max_loaded:
+                    collect(wait(running, return_when=FIRST_COMPLETED).done)
+
+                try:
+                    with stage(metrics, "load", symbol=symbol) as event:
+                        ticks = load_ticks(symbol, start, end, columns=["bid", "ask", "volume"], root=root,
+                                           broker=broker)
+                        event["ticks"] = len(ticks)
+                    if len(ticks) == 0:
+                        raise Exception(f"No tick for {symbol} in the tick store")
+                    block, description = share_ticks(ticks)
+                    del ticks
+                except Exception as error:
+                    failures[symbol] = repr(error)
+                    continue
+
+                loaded[symbol] = (block, set(), {})
+                for group in spec_groups:
+                    future = executor.submit(build_bars, description, group, slippage_window, metrics)
+                    running[future] = symbol
+                    loaded[symbol][1].add(future)
+
+            while running:
+                collect(wait(running, return_when=FIRST_COMPLETED).done)
+    finally:
+        # The shared memory is not freed by the OS when the process stops
+        for block, _, _ in loaded.values():
+            block.close()
+            block.unlink()
+
+    return results, failures
+
+
+def spec_name(spec):
+    return "-".join(str(value) for value in spec)
+
+
+if __name__ == '__main__':
+    metrics = Metrics(metrics_path) if metrics_path else None
+    os.makedirs(output_folder, exist_ok=True)
+
+    def save_bars(symbol, bars):
+        for spec, spec_bars in bars.items():
+            spec_bars.to_parquet(os.path.join(output_folder, f"{symbol}-{spec_name(spec)}.parquet"))
+        print(f"{symbol}: {sum(len(spec_bars) for spec_bars in bars.values())} bars")
+
+    start = time.perf_counter()
+    _, failures = run_batch(symbols, specs, start_date, end_date, root, broker, workers, max_loaded,
+                            on_result=save_bars, metrics=metrics)
+    for symbol, error in failures.items():
+        print(f"The bars of {symbol} have not been built: {error}")
+    if metrics_path:
+        print(summarize(metrics_path).to_string())
+    print(f"{(time.perf_counter() - start) / 60} minutes")
@@ -1,12 +1,16 @@
 import os
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 
 # Define the root folder
 root_folder = r'C:\Users\Oliver\Desktop\admiral\DATA\USDJPY-Admiral-Markets'
 
-# Create a list to store dictionaries of file information
-file_info_list = []
+# False: only read the files to build the report, True: also remove the duplicates from the files which have some
+remove_duplicates = False
+
+# Where to save the report (None to only print it)
+report_path = 'quality_report.csv'
 
 # Function to process each Parquet file
 def process_parquet(file_path):
@@ -14,47 +18,78 @@ def process_parquet(file_path):
     df = pd.read_parquet(file_path)
 
     # Check for missing values
-    missing_values_count = df.isnull().sum().sum()
+    missing_values_count = int(df.isnull().sum().sum())
 
     # Count duplicates
-    duplicate_count = df.duplicated().sum()
-
-    # Remove duplicates
-    df.drop_duplicates(inplace=True)
+    duplicates = df.duplicated()
+    duplicate_count = int(duplicates.sum())
 
-    # Save changes to the same file
-    df.to_parquet(file_path, compression='gzip')
+    # Only the files with duplicates are rewritten, in a temporary file first so a crash
+    # can never leave a half written file
+    rewritten = remove_duplicates and duplicate_count > 0
+    if rewritten:
+        df[~duplicates].to_parquet(file_path + '.tmp', compression='gzip')
+        os.replace(file_path + '.tmp', file_path)
 
     # Extract relevant parts of file path for index
     parts = file_path.split(os.sep)
-    index = os.sep.join(parts[-3:])  # Take the last three parts (file name and two subfolders)
 
     # Construct dictionary for file information
-    file_info = {
+    return {
         'File Name': parts[-1],  # File name
         'Subfolder 1': parts[-3],  # First subfolder
         'Subfolder 2': parts[-2],  # Second subfolder
+        'Ticks': len(df),
+        'First Tick': df.index.min() if len(df) > 0 else pd.NaT,
+        'Last Tick': df.index.max() if len(df) > 0 else pd.NaT,
         'Missing Values': missing_values_count,
-        'Duplicates Deleted': duplicate_count
+        'Duplicates': duplicate_count,
+        'Rewritten': rewritten
     }
 
-    # Append file information to the list
-    file_info_list.append(file_info)
 
-# Walk through each folder and subfolder
-for folder_path, _, files in os.walk(root_folder):
-    for file in tqdm(files, desc=f"Processing {folder_path}"):
-        if file.endswith('.parquet'):
-            file_path = os.path.join(folder_path, file)
-            process_parquet(file_path)
+# One unreadable file must not stop the scan: its error is written in the report
+def scan_parquet(file_path):
+    try:
+        return process_parquet(file_path)
+    except Exception as error:
+        parts = file_path.split(os.sep)
+        return {'File Name': parts[-1], 'Subfolder 1': parts[-3], 'Subfolder 2': parts[-2],
+                'Rewritten': False, 'Error': repr(error)}
+
+
+if __name__ == '__main__':
+    # Walk through each folder and subfolder
+    file_paths = []
+    for folder_path, _, files in os.walk(root_folder):
+        for file in files:
+            if file.endswith('.parquet'):
+                file_paths.append(os.path.join(folder_path, file))
+
+    # The files are scanned in parallel, each worker returns the information of its file
+    with ProcessPoolExecutor() as executor:
+        file_info_list = list(tqdm(executor.map(scan_parquet, sorted(file_paths), chunksize=16),
+                                   total=len(file_paths), desc=f"Processing {root_folder}"))
+
+    # Create a DataFrame from the list of file information dictionaries
+    file_info_df = pd.DataFrame(file_info_list)
+    if 'Error' not in file_info_df.columns:
+        file_info_df['Error'] = None
+
+    # Set the index to file path and keep only the file name and the next two subfolders
+    file_info_df.set_index('File Name', inplace=True)
+    file_info_df.index.name = None  # Remove the name of the index
 
-# Create a DataFrame from the list of file information dictionaries
-file_info_df = pd.DataFrame(file_info_list)
+    # Print the DataFrame
+    print(file_info_df)
+    print(f"{file_info_df['Rewritten'].sum()} file(s) rewritten out of {len(file_info_df)}")
 
-# Set the index to file path and keep only the file name and the next two subfolders
-file_info_df.set_index('File Name', inplace=True)
-file_info_df.index.name = None  # Remove the name of the index
-file_info_df = file_info_df[['Subfolder 1', 'Subfolder 2', 'Missing Values', 'Duplicates Deleted']]
+    # The files which could not be read
+    failed = file_info_df[file_info_df['Error'].notna()]
+    if len(failed) > 0:
+        print(f"{len(failed)} file(s) could not be read:")
+        for file_name, error in failed['Error'].items():
+            print(f"{file_name}: {error}")
 
-# Print the DataFrame
-print(file_info_df)
+    if report_path is not None:
+        file_info_df.to_csv(report_path)
@@ -0,0 +1,57 @@
+"""
+Compact representation of the ticks: the bid and ask prices are stored as int32 numbers of
+points (1 point = 10**-digits, 5 digits for EURUSD) instead of float64, the timestamps stay
+the int64 nanoseconds of the DatetimeIndex. The number of digits is kept in df.attrs["digits"].
+
+A price p is stored as round(p * 10**digits) and decoded with points / 10**digits, which gives
+back exactly the float of the broker as long as it has at most `digits` decimals.
+"""
+import numpy as np
+
+
+def to_compact(ticks, digits=5):
+    """
+    Compact copy of a DataFrame of ticks (bid, ask and the other columns unchanged),
+    the helper column index is dropped: it is the position of the tick
+    """
+    compact = ticks.drop(columns=[column for column in ["index", "price", "sign_var"] if column in ticks.columns])
+    for column in ["bid", "ask"]:
+        prices = ticks[column].to_numpy(dtype="float64")
+        points = np.rint(prices * 10 ** digits)
+
+        if np.abs(points).max(initial=0) > np.iinfo("int32").max:
+            raise Exception(f"The {column} prices are too high to be stored with {digits} digits")
+        if not (points / 10 ** digits == prices).all():
+            raise Exception(f"The {column} prices have more than {digits} digits")
+        compact[column] = points.astype("int32")
+
+    compact.attrs["digits"] = digits
+    return compact
+
+
+def is_compact(ticks):
+    return ticks.attrs.get("digits") is not None
+
+
+def decode_prices(values, digits):
+    """
+    Float prices from numbers of points (the float prices are returned unchanged)
+    """
+    values = np.asarray(values)
+    if digits is None or not np.issubdtype(values.dtype, np.integer):
+        return values
+    return values / 10 ** digits
+
+
+def from_compact(ticks):
+    """
+    DataFrame of ticks with float64 prices from the compact representation
+    """
+    if not is_compact(ticks):
+        return ticks
+
+    ticks = ticks.copy()
+    for column in ["bid", "ask"]:
+        ticks[column] = decode_prices(ticks[column].to_numpy(), ticks.attrs["digits"])
+    ticks.attrs.pop("digits")
+    return ticks
@@ -0,0 +1,162 @@
+"""
+Instrumentation of the import, cleaning and bar building stages. The functions take an
+optional metrics object (metrics=None by default): without it, the stages cost one test.
+With a Metrics, every stage writes one JSON line (duration, counters such as the number of
+ticks or bars, memory peak) that summarize() aggregates:
+    {"event": "stage", "stage": "read", "seconds": 0.12, "ticks": 153000, "path": ..., "pid": ...}
+
+Any object with the same stage/count/error methods can be given instead (to send the
+metrics to another system for example).
+"""
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+import pandas as pd
+
+
+class Metrics:
+
+    def __init__(self, path="metrics.jsonl", memory=False, **context):
+        """
+        - path (str): JSON lines file where the events are appended, the events are only kept
+          in memory (self.events) if None
+        - memory (bool): measure the peak of the memory allocated by Python during each stage
+          with tracemalloc (it slows down the code, the peaks are exact for a single thread)
+        - context: fields added to every event (symbol, run name...)
+
+        A Metrics can be sent to worker processes: each process appends its own events to the file.
+        """
+        self.path = path
+        self.memory = memory
+        self.context = context
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ["lock", "local"]:
+            state.pop(name)
+        state["events"] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def emit(self, event):
+        event = dict(self.context, **event, pid=os.getpid(), time=time.time())
+        with self.lock:
+            if self.path is None:
+                self.events.append(event)
+                return
+            # One short append by event, so several processes can share the file
+            with open(self.path, "a") as file:
+                file.write(json.dumps(event, default=str) + "\n")
+
+    def stage(self, name, **fields):
+        """
+        Context manager which measures a stage. It gives a dict where the counters known at
+        the end of the stage can be added:
+            with metrics.stage("outlier_test", ticks=len(df)) as event:
+                ...
+                event["outliers"] = nb_outliers
+        """
+        return Stage(self, name, fields)
+
+    def count(self, name, value=1, **fields):
+        self.emit(dict(fields, event="count", name=name, value=value))
+
+    def error(self, stage_name, error, **fields):
+        self.emit(dict(fields, event="error", stage=stage_name, error=repr(error)))
+
+    def _memory_start(self):
+        # The peaks of the nested stages are given to their parents before the peak is reset
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        stack = self.local.__dict__.setdefault("stack", [])
+        peak = tracemalloc.get_traced_memory()[1]
+        for entry in stack:
+            entry[0] = max(entry[0], peak)
+        tracemalloc.reset_peak()
+        stack.append([0])
+
+    def _memory_end(self):
+        stack = self.local.stack
+        peak = max(stack.pop()[0], tracemalloc.get_traced_memory()[1])
+        if stack:
+            stack[-1][0] = max(stack[-1][0], peak)
+        tracemalloc.reset_peak()
+        return peak
+
+
+class Stage:
+    """
+    Measure of one stage (see Metrics.stage)
+    """
+
+    def __init__(self, metrics, name, fields):
+        self.metrics = metrics
+        self.event = dict(fields, event="stage", stage=name)
+
+    def __enter__(self):
+        if self.metrics.memory:
+            self.metrics._memory_start()
+        self.start = time.perf_counter()
+        return self.event
+
+    def __exit__(self, error_type, error, traceback):
+        self.event["seconds"] = time.perf_counter() - self.start
+        if self.metrics.memory:
+            self.event["memory_peak_mb"] = self.metrics._memory_end() / 2 ** 20
+        if error is not None:
+            self.event["error"] = repr(error)
+        self.metrics.emit(self.event)
+        return False
+
+
+def stage(metrics, name, **fields):
+    """
+    metrics.stage(name, **fields) or, without metrics, a context which does nothing
+    (it gives a dict which is thrown away)
+    """
+    return nullcontext({}) if metrics is None else metrics.stage(name, **fields)
+
+
+def load_events(path):
+    with open(path) as file:
+        return pd.DataFrame([json.loads(line) for line in file if line.strip()])
+
+
+def summarize(events):
+    """
+    Aggregate the stages of a metrics file (path) or of a DataFrame of events: number of calls,
+    total and mean duration, ticks and bars, ticks per second, highest memory peak and errors
+    """
+    events = load_events(events) if isinstance(events, str) else events
+    if len(events) == 0 or "stage" not in events.columns:
+        return pd.DataFrame()
+
+    stages = events[events["event"] == "stage"]
+    summary = stages.groupby("stage").agg(calls=("seconds", "size"), seconds=("seconds", "sum"),
+                                          mean_seconds=("seconds", "mean"))
+    for column in ["ticks", "bars"]:
+        if column in stages.columns:
+            summary[column] = stages.groupby("stage")[column].sum(min_count=1)
+    if "ticks" in summary.columns:
+        summary["ticks_per_second"] = summary["ticks"] / summary["seconds"]
+    if "memory_peak_mb" in stages.columns:
+        summary["memory_peak_mb"] = stages.groupby("stage")["memory_peak_mb"].max()
+
+    # The errors are the error events and the stages which raised an exception
+    failed = events["event"] == "error"
+    if "error" in events.columns:
+        failed |= (events["event"] == "stage") & events["error"].notna()
+    errors = events[failed].groupby("stage").size()
+    summary = summary.reindex(summary.index.union(errors.index))
+    summary["errors"] = errors.reindex(summary.index).fillna(0).astype(int)
+    return summary.sort_values("seconds", ascending=False)
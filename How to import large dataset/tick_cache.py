@@ -0,0 +1,132 @@
+"""
+Flat memory-mappable copy of the ticks of a symbol, exported once from the tick store:
+    {cache_root}/{symbol}-{broker}/time.bin    int64 nanoseconds (UTC)
+    {cache_root}/{symbol}-{broker}/bid.bin     float64
+    {cache_root}/{symbol}-{broker}/ask.bin     float64
+    {cache_root}/{symbol}-{broker}/volume.bin  float64 (0 when the broker gives no volume)
+    {cache_root}/{symbol}-{broker}/days.npz    first position of each GMT day
+    {cache_root}/{symbol}-{broker}/meta.json   number of ticks and timezone
+
+The arrays are opened with np.memmap, so the processes which read the same cache share
+the OS page cache instead of holding their own copy of the ticks.
+"""
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from tick_store import iter_ticks
+
+CACHE_COLUMNS = {"time": "int64", "bid": "float64", "ask": "float64", "volume": "float64"}
+DAY = 24 * 3600 * 10 ** 9
+
+
+def export_tick_cache(symbol, cache_root="CACHE", start=None, end=None, root="DATA", broker="Admiral-Markets"):
+    """
+    Write the ticks of the tick store between start and end in the cache, one partition at a
+    time (bounded memory). The previous cache of the symbol is replaced at the end.
+    """
+    folder = os.path.join(cache_root, f"{symbol}-{broker}")
+    tmp_folder = folder + ".tmp"
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+    os.makedirs(tmp_folder)
+
+    files = {column: open(os.path.join(tmp_folder, f"{column}.bin"), "wb") for column in CACHE_COLUMNS}
+    days, offsets = [], []
+    size, tz = 0, None
+    try:
+        for ticks in iter_ticks(symbol, start, end, root=root, broker=broker):
+            tz = str(ticks.index.tz) if ticks.index.tz is not None else None
+            time = ticks.index.asi8
+            volume = ticks["volume"] if "volume" in ticks.columns else np.zeros(len(ticks))
+            for column, values in [("time", time), ("bid", ticks["bid"]), ("ask", ticks["ask"]), ("volume", volume)]:
+                files[column].write(np.ascontiguousarray(values, dtype=CACHE_COLUMNS[column]).tobytes())
+
+            # First position of each new day
+            chunk_days = time // DAY
+            new_day = np.flatnonzero(np.diff(chunk_days, prepend=days[-1] if days else chunk_days[0] - 1))
+            days.extend(chunk_days[new_day].tolist())
+            offsets.extend((size + new_day).tolist())
+            size += len(ticks)
+    finally:
+        for file in files.values():
+            file.close()
+
+    np.savez(os.path.join(tmp_folder, "days.npz"), days=np.array(days, dtype="int64") * DAY,
+             offsets=np.array(offsets + [size], dtype="int64"))
+    with open(os.path.join(tmp_folder, "meta.json"), "w") as file:
+        json.dump({"size": size, "tz": tz, "columns": CACHE_COLUMNS}, file)
+
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
+    os.rename(tmp_folder, folder)
+    return folder
+
+
+class TickCache:
+
+    def __init__(self, symbol, cache_root="CACHE", broker="Admiral-Markets"):
+        """
+        Open the cache of a symbol written by export_tick_cache (read only, nothing is loaded)
+        """
+        self.folder = os.path.join(cache_root, f"{symbol}-{broker}")
+        with open(os.path.join(self.folder, "meta.json")) as file:
+            meta = json.load(file)
+        self.size = meta["size"]
+        self.tz = meta["tz"]
+
+        self.columns = {}
+        for column, dtype in meta["columns"].items():
+            path = os.path.join(self.folder, f"{column}.bin")
+            # np.memmap does not accept empty files
+            self.columns[column] = np.memmap(path, dtype=dtype, mode="r", shape=(self.size,)) if self.size > 0 \
+                else np.array([], dtype=dtype)
+
+        days = np.load(os.path.join(self.folder, "days.npz"))
+        self.days, self.offsets = days["days"], days["offsets"]
+
+    def __len__(self):
+        return self.size
+
+    def positions(self, start=None, end=None):
+        """
+        Positions [first, last) of the ticks between start (included) and end (excluded),
+        the naive dates are considered as GMT dates
+        """
+        first, last = 0, self.size
+        if start is not None:
+            first = self._position(start)
+        if end is not None:
+            last = self._position(end)
+        return first, max(first, last)
+
+    def _position(self, date):
+        date = pd.Timestamp(date)
+        date = date.tz_localize("GMT") if date.tz is None else date
+        # The day index gives the part of the timestamps where the binary search is done
+        day = np.searchsorted(self.days, (date.value // DAY) * DAY, side="left")
+        lower, upper = self.offsets[min(day, len(self.days))], self.offsets[min(day + 1, len(self.days))]
+        return lower + np.searchsorted(self.columns["time"][lower:upper], date.value, side="left")
+
+    def arrays(self, start=None, end=None):
+        """
+        Views (no copy) of the time, bid, ask and volume arrays between start and end
+        """
+        first, last = self.positions(start, end)
+        return {column: values[first:last] for column, values in self.columns.items()}
+
+    def timestamps(self, start=None, end=None):
+        """
+        DatetimeIndex of the ticks between start and end, on the memory-mapped timestamps
+        """
+        return to_datetime_index(self.arrays(start, end)["time"], self.tz)
+
+
+def to_datetime_index(time, tz=None, name="time"):
+    """
+    DatetimeIndex on an int64 nanoseconds array without copying it
+    """
+    dtype = pd.DatetimeTZDtype(tz=tz) if tz is not None else np.dtype("datetime64[ns]")
+    values = pd.arrays.DatetimeArray(np.asarray(time).view("datetime64[ns]"), dtype=dtype, copy=False)
+    return pd.DatetimeIndex(values, copy=False, name=name)
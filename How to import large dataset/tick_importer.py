@@ -0,0 +1,201 @@
+"""
+Import the ticks of a source (see tick_sources.py) into daily GMT partitions. The source is
+queried with large non-overlapping windows, fetched concurrently, and each window is split
+into days locally: every tick is downloaded and converted only once.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from tick_store import symbol_folder, daily_path, write_ticks, read_empty_days, write_empty_days, day_counts, \
+    to_gmt
+from instrumentation import stage
+
+
+def make_windows(start, end, window_days=30):
+    """
+    Non-overlapping windows [window_start, window_end) of the clock of the source which cover
+    the GMT days between start and end (one day of margin for the timezone of the source)
+    """
+    windows = []
+    window_start, last = start - timedelta(days=1), end + timedelta(days=1)
+    while window_start < last:
+        window_end = min(window_start + timedelta(days=window_days), last)
+        windows.append((window_start, window_end))
+        window_start = window_end
+    return windows
+
+
+def source_to_gmt(date, timezone):
+    """
+    GMT timestamp of a naive date of the clock of the source
+    """
+    return pd.Timestamp(date).tz_localize(timezone, ambiguous=True, nonexistent="shift_forward").tz_convert("GMT")
+
+
+def fetch_window(source, symbol, start, end, retries=3, backoff=1, metrics=None):
+    """
+    Fetch the ticks of one window, the failed fetches are retried after 1s, 2s, 4s...
+    Return the ticks with a GMT index.
+    """
+    for attempt in range(retries + 1):
+        try:
+            with stage(metrics, "fetch", symbol=symbol, start=start, end=end, attempt=attempt) as event:
+                ticks = source.fetch(symbol, start, end)
+                event["ticks"] = len(ticks)
+            break
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+    # We convert the time of the source into GMT+0 time. When the clocks go back, an hour is
+    # repeated: its ticks are in summer time until the clock of the ticks goes back
+    naive = ticks.index.asi8
+    ambiguous = np.asarray(ticks.index.tz_localize(source.timezone, ambiguous="NaT", nonexistent="shift_forward").isna())
+    backward = np.cumsum(np.diff(naive, prepend=naive[:1]) < 0)
+    run_start = np.maximum.accumulate(np.where(ambiguous & ~np.append(False, ambiguous[:-1]), np.arange(len(naive)), 0))
+    summer_time = backward == backward[run_start]
+    index = ticks.index.tz_localize(source.timezone, ambiguous=summer_time, nonexistent="shift_forward")
+    ticks = ticks.set_axis(index.tz_convert("GMT").rename("time"), axis=0)
+    if not ticks.index.is_monotonic_increasing:
+        ticks = ticks.sort_index(kind="stable")
+    return ticks
+
+
+def import_ticks(source, symbol, start, end, root="DATA", broker="Admiral-Markets", window_days=30, max_workers=4,
+                 retries=3, use_processes=False, codec="gzip", metrics=None):
+    """
+    Import the ticks of the GMT days between start (included) and end (excluded), one file by day
+    in {root}/{symbol}-{broker}/{year}/{month}/{day}.parquet.
+    - source (TickSource): where the ticks come from (MT5TickSource, FakeTickSource...)
+    - window_days (int): number of days fetched by each query
+    - max_workers (int): number of windows fetched at the same time
+    - retries (int): number of retries of a failed window
+    - use_processes (bool): fetch in processes instead of threads (each process has its own
+      MT5 connection), the source must be picklable
+    - metrics (Metrics): optional, measure every fetch and write (see instrumentation.py)
+
+    The windows are fetched concurrently but assembled in order: the ticks of the GMT day which
+    is not complete at the end of a window are carried to the next one. Return the windows
+    which failed after all the retries, the days they touch are not written. The days without
+    any tick have no file, they are listed in empty_days.json.
+    """
+    folder = symbol_folder(symbol, root, broker)
+    empty_days = set(read_empty_days(folder))
+    known_empty_days = set(empty_days)
+    windows = make_windows(start, end, window_days)
+    last_day = pd.Timestamp(end).tz_localize("GMT")
+    next_day = pd.Timestamp(start).tz_localize("GMT")  # Next day to write
+    carry = None  # Ticks of the days which are not complete at the end of the previous window
+    failures = []
+
+    executor = ProcessPoolExecutor(max_workers) if use_processes else ThreadPoolExecutor(max_workers)
+    with executor:
+        futures = {}
+        for k, (window_start, window_end) in enumerate(windows):
+            # Only a few windows are fetched in advance to bound the memory
+            for j in range(k, min(k + 2 * max_workers, len(windows))):
+                if j not in futures:
+                    futures[j] = executor.submit(fetch_window, source, symbol, *windows[j], retries, 1, metrics)
+            boundary = source_to_gmt(window_end, source.timezone)
+
+            try:
+                ticks = futures.pop(k).result()
+            except Exception as error:
+                # The days before the end of this window can't be complete anymore
+                failures.append((window_start, window_end, repr(error)))
+                if metrics is not None:
+                    metrics.count("failed_windows", symbol=symbol, start=window_start, end=window_end)
+                carry = None
+                next_day = max(next_day, boundary.ceil("D"))
+                continue
+
+            ticks = ticks if carry is None or len(carry) == 0 else pd.concat([carry, ticks])
+
+            # The GMT days which finish before the end of the window are complete
+            complete_end = min(boundary.floor("D"), last_day)
+            while next_day < complete_end:
+                positions = ticks.index.searchsorted([next_day, next_day + timedelta(days=1)], side="left")
+                if positions[1] > positions[0]:
+                    with stage(metrics, "write", symbol=symbol, day=next_day, ticks=int(positions[1] - positions[0])):
+                        write_ticks(ticks.iloc[positions[0]:positions[1]], daily_path(folder, next_day), codec)
+                    empty_days.discard(next_day)
+                else:
+                    empty_days.add(next_day)
+                next_day += timedelta(days=1)
+
+            carry = ticks.iloc[ticks.index.searchsorted(complete_end, side="left"):]
+
+    if empty_days != known_empty_days:
+        write_empty_days(folder, empty_days)
+    return failures
+
+
+def day_runs(days):
+    """
+    Group sorted days into consecutive runs [run_start, run_end)
+    """
+    runs = []
+    for day in days:
+        if runs and runs[-1][1] == day:
+            runs[-1][1] = day + timedelta(days=1)
+        else:
+            runs.append([day, day + timedelta(days=1)])
+    return runs
+
+
+def update_ticks(source, symbol, start, end, root="DATA", broker="Admiral-Markets", **kwargs):
+    """
+    Incremental version of import_ticks (same parameters): only the days between start and end
+    which are not in the store (no file and not known as empty) are imported, plus the last
+    day of the store which may have been imported before its end. The history is not fetched
+    again, so a nightly update only imports the new days.
+    """
+    folder = symbol_folder(symbol, root, broker)
+    known_days = set(day_counts(folder).index) | set(read_empty_days(folder))
+    last_day = max(known_days) if known_days else None
+
+    days = pd.date_range(start, end, freq="D", inclusive="left", tz="GMT")
+    missing = [day for day in days if day not in known_days or day == last_day]
+
+    failures = []
+    for run_start, run_end in day_runs(missing):
+        failures += import_ticks(source, symbol, run_start.tz_localize(None).to_pydatetime(),
+                                 run_end.tz_localize(None).to_pydatetime(), root, broker, **kwargs)
+    return failures
+
+
+def find_gaps(symbol, start=None, end=None, root="DATA", broker="Admiral-Markets", min_ratio=0.2, window=20):
+    """
+    Report the gaps of the history of a symbol, from the metadata of the files only:
+    - missing: day not imported (no file and not known as empty)
+    - empty: week day (monday to friday) without any tick
+    - few ticks: week day with less than min_ratio times the median number of ticks of the
+      `window` week days around it
+    Return a DataFrame with the GMT days as index and the ticks, expected and gap columns.
+    """
+    folder = symbol_folder(symbol, root, broker)
+    counts = day_counts(folder, start, end)
+    empty_days = [day for day in read_empty_days(folder) if day not in counts.index]
+    counts = pd.concat([counts, pd.Series(0, index=pd.DatetimeIndex(empty_days, tz="GMT"), dtype="int64")])
+    if len(counts) == 0:
+        return pd.DataFrame(columns=["ticks", "expected", "gap"])
+
+    first = to_gmt(start).floor("D") if start is not None else counts.index.min()
+    last = to_gmt(end).floor("D") - timedelta(days=1) if end is not None else counts.index.max()
+    days = pd.date_range(first, last, freq="D", tz="GMT")
+    report = pd.DataFrame({"ticks": counts.reindex(days)}, index=days)
+
+    # Expected number of ticks of a week day from the other week days
+    week_days = report.index.dayofweek < 5
+    traded = report["ticks"].where(week_days & (report["ticks"] > 0))
+    report["expected"] = traded[week_days].rolling(window, center=True, min_periods=1).median().reindex(days)
+
+    report["gap"] = None
+    report.loc[week_days & (report["ticks"] < min_ratio * report["expected"]), "gap"] = "few ticks"
+    report.loc[week_days & (report["ticks"] == 0), "gap"] = "empty"
+    report.loc[report["ticks"].isna(), "gap"] = "missing"
+    return report[report["gap"].notna()]
+
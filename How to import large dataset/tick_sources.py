@@ -0,0 +1,95 @@
+"""
+Sources of ticks used by the importer (tick_importer.py). A source gives the ticks of a symbol
+between two dates of its own clock, so the importer can be run with MetaTrader 5 or, on a
+machine without it, with a local fake.
+"""
+import threading
+import time
+import pandas as pd
+
+
+class TickSource:
+    """
+    Interface of a tick source
+    - timezone (str): timezone of the dates of the source (EET for Admiral Markets)
+    """
+    timezone = "GMT"
+
+    def fetch(self, symbol, start, end):
+        """
+        Return the ticks of the symbol with start <= time < end (naive datetimes in the timezone
+        of the source) in a DataFrame with the time as index (naive, same timezone) and at
+        least the bid and ask columns. Raise an exception if the ticks can't be fetched.
+        """
+        raise NotImplementedError
+
+
+class MT5TickSource(TickSource):
+
+    def __init__(self, timezone="EET", columns=("time", "bid", "ask")):
+        """
+        Ticks of the MetaTrader 5 terminal.
+        BE CAREFUL, Admiral Markets uses the EET time, your broker may use another one.
+        - columns (tuple): columns of the MT5 ticks we keep
+        """
+        self.timezone = timezone
+        self.columns = list(columns)
+
+    def fetch(self, symbol, start, end):
+        # MetaTrader5 only exists on Windows, it is imported when the first ticks are fetched
+        # (in each process when the importer runs in several processes)
+        import MetaTrader5 as mt5
+        if mt5.terminal_info() is None and not mt5.initialize():
+            raise Exception(f"MT5 initialization failed: {mt5.last_error()}")
+
+        ticks = mt5.copy_ticks_range(symbol, start, end, mt5.COPY_TICKS_ALL)
+        if ticks is None:
+            raise Exception(f"MT5 copy_ticks_range failed: {mt5.last_error()}")
+
+        # Convert number format of the date into date format
+        df_ticks = pd.DataFrame(ticks, columns=self.columns)
+        df_ticks["time"] = pd.to_datetime(df_ticks["time"], unit="s")
+        df_ticks = df_ticks.set_index("time")
+
+        # copy_ticks_range includes the end date, the windows of the importer must not overlap
+        return df_ticks[(df_ticks.index >= start) & (df_ticks.index < end)]
+
+
+class FakeTickSource(TickSource):
+
+    def __init__(self, ticks, timezone="EET", failures=0, delay=0):
+        """
+        Local source which serves the ticks of a DataFrame (GMT index), to test the importer
+        - timezone (str): clock of the fake broker
+        - failures (int): number of failed fetches before each window is served (retries test)
+        - delay (float): seconds waited by each fetch (concurrency test)
+        """
+        self.timezone = timezone
+        self.ticks = ticks.copy()
+        self.ticks.index = self.ticks.index.tz_convert(timezone).tz_localize(None)
+        self.failures = failures
+        self.delay = delay
+        self.calls = []  # (start, end) of every fetch
+        self.lock = threading.Lock()
+
+    def fetch(self, symbol, start, end):
+        with self.lock:
+            self.calls.append((start, end))
+            attempts = self.calls.count((start, end))
+        time.sleep(self.delay)
+
+        if attempts <= self.failures:
+            raise Exception(f"Fake failure {attempts} for {symbol} {start} {end}")
+
+        # The local clock is not sorted when the clocks go back (DST), so no binary search
+        return self.ticks[(self.ticks.index >= start) & (self.ticks.index < end)]
+
+    def __getstate__(self):
+        # The lock can't be sent to the processes of the importer (each one counts its own calls)
+        state = self.__dict__.copy()
+        state.pop("lock")
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
@@ -0,0 +1,252 @@
+"""
+Dataset layer on top of the layout written by the import scripts:
+    {root}/{symbol}-{broker}/{year}/{month}/{day}.parquet  (ticks of one GMT day)
+    {root}/{symbol}-{broker}/{year}/{month}.parquet        (compacted month, one row group by day)
+    {root}/{symbol}-{broker}/empty_days.json               (GMT days imported without any tick)
+"""
+import json
+import os
+from datetime import datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+def symbol_folder(symbol, root="DATA", broker="Admiral-Markets"):
+    """
+    Folder which contains all the ticks of a symbol (use broker="Admiral-Markets-clean"
+    for example to read the cleaned ticks)
+    """
+    return os.path.join(root, f"{symbol}-{broker}")
+
+
+def daily_path(folder, date):
+    return os.path.join(folder, date.strftime("%Y"), date.strftime("%m"), f"{date.strftime('%d')}.parquet")
+
+
+def monthly_path(folder, date):
+    return os.path.join(folder, date.strftime("%Y"), f"{date.strftime('%m')}.parquet")
+
+
+def to_gmt(date):
+    """
+    Timestamp in GMT, the naive dates are considered as GMT dates
+    """
+    date = pd.Timestamp(date)
+    return date.tz_localize("GMT") if date.tz is None else date.tz_convert("GMT")
+
+
+def list_partitions(folder, start=None, end=None):
+    """
+    Paths of the partitions of a symbol folder in chronological order, a compacted month
+    replaces the daily files of this month. With start and end, only the partitions which
+    can contain ticks in [start, end) are returned (partition pruning).
+    """
+    partitions = []
+    for year in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+        year_folder = os.path.join(folder, year)
+        if not (year.isdigit() and os.path.isdir(year_folder)):
+            continue
+
+        months = sorted({name[:2] for name in os.listdir(year_folder) if name[:2].isdigit()})
+        for month in months:
+            month_start = to_gmt(datetime(int(year), int(month), 1))
+            month_end = month_start + pd.offsets.MonthBegin(1)
+            if (start is not None and month_end <= to_gmt(start)) or (end is not None and month_start >= to_gmt(end)):
+                continue
+
+            if os.path.exists(os.path.join(year_folder, f"{month}.parquet")):
+                partitions.append(os.path.join(year_folder, f"{month}.parquet"))
+                continue
+
+            month_folder = os.path.join(year_folder, month)
+            days = sorted(name for name in os.listdir(month_folder) if name.endswith(".parquet"))
+            for day in days:
+                day_start = to_gmt(datetime(int(year), int(month), int(day[:2])))
+                if (start is not None and day_start + pd.Timedelta(days=1) <= to_gmt(start)) or \
+                        (end is not None and day_start >= to_gmt(end)):
+                    continue
+                partitions.append(os.path.join(month_folder, day))
+
+    return partitions
+
+
+def time_filter(path, start, end):
+    """
+    Filter on the time column of a partition, it is pushed down to the row groups
+    statistics so the row groups outside [start, end) are not even decompressed
+    """
+    time_type = pq.read_schema(path).field("time").type
+    conditions = []
+    for date, keep in [(start, lambda field, value: field >= value), (end, lambda field, value: field < value)]:
+        if date is not None:
+            value = pa.scalar(to_gmt(date).value, type=pa.timestamp("ns", tz=time_type.tz))
+            if time_type.tz is None:
+                value = pa.scalar(to_gmt(date).tz_localize(None).value, type=pa.timestamp("ns"))
+            conditions.append(keep(ds.field("time"), value.cast(time_type)))
+
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else conditions[0] & conditions[1]
+
+
+def read_partition(path, start=None, end=None, columns=None):
+    """
+    Read the ticks of one partition between start (included) and end (excluded) as an Arrow
+    table with the time as a column (None if the partition is empty)
+    """
+    # The empty days (week-end) are skipped without reading them
+    parquet_file = pq.ParquetFile(path)
+    if parquet_file.metadata.num_rows == 0:
+        return None
+
+    # The columns which are not in the partition are skipped (MT5 does not give the volume of every symbol)
+    read_columns = None if columns is None else \
+        ["time"] + [column for column in columns if column != "time" and column in parquet_file.schema_arrow.names]
+    table = pq.read_table(path, columns=read_columns, filters=time_filter(path, start, end),
+                          use_pandas_metadata=False)
+    return table.replace_schema_metadata(None)
+
+
+def to_ticks(table):
+    """
+    DataFrame of ticks with the time as index from an Arrow table
+    """
+    ticks = table.to_pandas().set_index("time")
+    if not ticks.index.is_monotonic_increasing:
+        ticks = ticks.sort_index(kind="stable")
+    return ticks
+
+
+def load_ticks(symbol, start=None, end=None, columns=None, root="DATA", broker="Admiral-Markets"):
+    """
+    Load the ticks of a symbol between start (included) and end (excluded) in one DataFrame
+    with the time as index.
+    - columns (list): columns to read (for example ["bid", "ask"]), all of them if None, the columns
+      which are not in the store are skipped
+    """
+    tables = []
+    for path in list_partitions(symbol_folder(symbol, root, broker), start, end):
+        table = read_partition(path, start, end, columns)
+        if table is not None:
+            tables.append(table)
+
+    if not tables:
+        return pd.DataFrame(columns=columns or ["bid", "ask"], index=pd.DatetimeIndex([], tz="GMT", name="time"))
+
+    # One conversion to pandas for all the partitions
+    return to_ticks(pa.concat_tables(tables))
+
+
+def iter_ticks(symbol, start=None, end=None, columns=None, root="DATA", broker="Admiral-Markets"):
+    """
+    Same as load_ticks but yield the ticks partition by partition (one day or one compacted
+    month at a time), to process a long history with a bounded memory
+    """
+    for path in list_partitions(symbol_folder(symbol, root, broker), start, end):
+        table = read_partition(path, start, end, columns)
+        if table is not None and table.num_rows > 0:
+            yield to_ticks(table)
+
+
+def write_ticks(df, path, codec="zstd", row_group_size=None):
+    """
+    Write a DataFrame of ticks in a partition (zstd and lz4 are much faster to decompress
+    than gzip for a similar size), through a temporary file so a partition is never half written
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_parquet(path + ".tmp", compression=codec, row_group_size=row_group_size)
+    os.replace(path + ".tmp", path)
+
+
+def read_empty_days(folder):
+    """
+    GMT days imported without any tick (week-ends, holidays), they have no file
+    """
+    path = os.path.join(folder, "empty_days.json")
+    if not os.path.exists(path):
+        return []
+    with open(path) as file:
+        return [to_gmt(day) for day in json.load(file)]
+
+
+def write_empty_days(folder, days):
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, "empty_days.json")
+    with open(path + ".tmp", "w") as file:
+        json.dump(sorted({day.strftime("%Y-%m-%d") for day in days}), file)
+    os.replace(path + ".tmp", path)
+
+
+def day_counts(folder, start=None, end=None):
+    """
+    Number of ticks of each GMT day in the store (0 for the empty files), read from the
+    parquet metadata only: the ticks are not read
+    """
+    counts = {}
+    for path in list_partitions(folder, start, end):
+        metadata = pq.ParquetFile(path).metadata
+        year, month, name = path.split(os.sep)[-3:]
+        if len(month) == 2:
+            # Daily file {year}/{month}/{day}.parquet
+            day = to_gmt(datetime(int(year), int(month), int(name[:2])))
+            counts[day] = counts.get(day, 0) + metadata.num_rows
+            continue
+
+        # Compacted month: one row group by day, its day is given by the statistics of the time
+        column = metadata.schema.names.index("time")
+        for k in range(metadata.num_row_groups):
+            row_group = metadata.row_group(k)
+            day = to_gmt(row_group.column(column).statistics.min).floor("D")
+            counts[day] = counts.get(day, 0) + row_group.num_rows
+
+    counts = pd.Series(counts, dtype="int64").sort_index()
+    if start is not None:
+        counts = counts[counts.index >= to_gmt(start).floor("D")]
+    if end is not None:
+        counts = counts[counts.index < to_gmt(end)]
+    return counts
+
+
+def compact_month(symbol, year, month, root="DATA", broker="Admiral-Markets", codec="zstd", remove_daily=False):
+    """
+    Merge the daily files of a finished month in {year}/{month}.parquet with one row group
+    by day, so a month is read with one file open and the days are still pruned with the
+    row groups statistics. The daily files are kept unless remove_daily.
+    """
+    folder = symbol_folder(symbol, root, broker)
+    month_start = datetime(year, month, 1)
+    if to_gmt(month_start) + pd.offsets.MonthBegin(1) > to_gmt(datetime.utcnow()):
+        raise Exception("Only the finished months can be compacted")
+
+    month_folder = os.path.join(folder, month_start.strftime("%Y"), month_start.strftime("%m"))
+    daily_paths = sorted(os.path.join(month_folder, name) for name in os.listdir(month_folder)
+                         if name.endswith(".parquet"))
+
+    path = monthly_path(folder, month_start)
+    writer = None
+    empty_days = []
+    for daily in daily_paths:
+        if pq.ParquetFile(daily).metadata.num_rows == 0:
+            empty_days.append(datetime(year, month, int(os.path.basename(daily)[:2])))
+            continue
+        table = pq.read_table(daily)
+        if writer is None:
+            writer = pq.ParquetWriter(path + ".tmp", table.schema, compression=codec)
+        writer.write_table(table.cast(writer.schema), row_group_size=table.num_rows)
+
+    if writer is None:
+        return None
+    writer.close()
+    os.replace(path + ".tmp", path)
+
+    # The empty daily files are hidden by the compacted month, their days are kept as empty
+    if empty_days:
+        write_empty_days(folder, read_empty_days(folder) + empty_days)
+
+    if remove_daily:
+        for daily in daily_paths:
+            os.remove(daily)
+        os.rmdir(month_folder)
+    return path